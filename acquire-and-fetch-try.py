@@ -26,7 +26,7 @@ scope.ConfigureTrigger("Edge",
 scope.ExportSignal( signal = 4 ,
 		outputTerminal = 'VAL_RTSI_0',
 		signalIdentifier = "End of record",)
-data = np.zeros([Z,X,Y],order='C',dtype=np.int32)
+data = np.zeros([Z,X,Y],order='C',dtype=np.int16)
 i=0
 #s = """\
 #try:
@@ -5,12 +5,20 @@ import signal as interrupt
 import subprocess
 import sys
 import cPickle
+import threading
+import Queue
+import collections
 from configobj import ConfigObj
 from validate import Validator
-from time import sleep
-from multiprocessing import Process, Queue
+from time import sleep, time
 from path import *
-from scipy import interpolate
+import resampler
+import bscan
+import ring
+import rawfile
+import background
+import timing
+import waveforms
 from PIL import Image
 
 interrupted = False
@@ -45,26 +53,15 @@ def move_daq(signal,daq_config):
     del daq
 
 def resample(raw_data, config, rsp_data=None,axis=0):
-    if rsp_data == None:
+    if rsp_data is None:
         n = 1024
-        rsp_data = np.zeros((n,raw_data.shape[-1]))
     else:
         n = rsp_data.shape[axis]
-    p = [config['resample_poly_coef']['p%d'%i] for i in range(8)]
-    f = np.poly1d(p)
-    old_x = f(np.arange(raw_data.shape[axis]))
-    new_x = np.linspace(0,raw_data.shape[axis],n)
-    if len(raw_data.shape) == 1:
-        tck = interpolate.splrep(old_x,raw_data,s=0)
-        rsp_data = interpolate.splev(new_x,tck)
-    else:
-        for line in range(raw_data.shape[-1]):
-            tck = interpolate.splrep(old_x,raw_data[:,line])
-            rsp_data[:,line] = interpolate.splev(new_x,tck)
-    return rsp_data
+    resample = resampler.make_resampler(config, raw_data.shape[axis], n)
+    return resample(raw_data, rsp_data, axis)
 
 def transform(config, rsp_data):
-    return abs(np.fft.fft(rsp_data.T).T)
+    return bscan.transform(rsp_data, depth=bscan.depth_window(config), axis=0)
 
 
 def horz_cal(config,data):
@@ -73,13 +70,17 @@ def horz_cal(config,data):
     scope.InitiateAcquisition()
     num = scope_config['Horizontal']['numPts']
     rec = scope_config['Horizontal']['numRecords']*2
+    # the reference spectrum is kept in volts, fetched as float64
     data = np.zeros((num,rec),order='F',dtype=np.float64)
     scope.Fetch('0,1',data)
-    np.savetxt('ref.dat',data,fmt='%.18e')
+    np.save('ref.npy',data)
     return data
 
 def load(config,data):
-    data = np.loadtxt('ref.dat').T
+    try:
+        data = np.load('ref.npy').T
+    except IOError:
+        data = np.loadtxt('ref.dat').T
     return data[0]
 
 def non_cor_fft(config,data):
@@ -98,6 +99,7 @@ def get_p(config,data):
     for i in p:
         config['resample_poly_coef']['p%d'%np.where(p==i)] = i
     config.write()    
+    resampler.invalidate()
     return data
 
 def convert_path_to_voltage(path,path_to_voltage_constants):
@@ -117,23 +119,114 @@ def configure_daq(mode,daq_config):
     daq.configure_timing_sample_clock(**daq_config[mode])
     return daq
 
+def hardware(config):
+    """Scope and analog output task classes of the configured backend, the
+    NI digitizer and DAQ card or their simulated stand-ins."""
+    if config['backend'] == 'simulated':
+        import simulated
+        vertical = config['scope']['VerticalSample']
+        settings = dict(config['simulation'],dtype=config['scope']['dtype'],
+            bits=config['scope']['bits'],voltage_range=vertical['voltageRange'],
+            offset=vertical['offset'])
+        class Scope(simulated.Scope):
+            def __init__(self,resourceName):
+                simulated.Scope.__init__(self,resourceName,**settings)
+        return Scope, simulated.AnalogOutputTask
+    try:
+        import niScope
+    except Exception:
+        print "niScope missing, continuing anyway"
+    try:
+        from nidaqmx import AnalogOutputTask
+    except Exception:
+        print "nidaqmx missing, continuing anyway"
+    return niScope.Scope, AnalogOutputTask
+
+class DaqSession:
+    """Galvo output task kept for a whole scan. The X and Y channels are
+    created once, afterwards only the waveform is rewritten and the
+    timing switched between the scan clock of the mode and the
+    positioning clock when it changes."""
+    def __init__(self,mode,daq_config,AnalogOutputTask):
+        self.mode = mode
+        self.config = daq_config
+        self.timing = None
+        self.task = AnalogOutputTask()
+        self.task.create_voltage_channel(**daq_config['X'])
+        self.task.create_voltage_channel(**daq_config['Y'])
+
+    def configure(self,timing,samples):
+        if self.timing == (timing,samples):
+            return
+        clock = dict(self.config[timing],samples_per_channel=samples)
+        self.task.configure_timing_sample_clock(**clock)
+        self.timing = (timing,samples)
+
+    def write(self,timing,signal):
+        self.task.stop()
+        self.configure(timing,len(signal))
+        self.task.write(signal)
+
+    def scan(self,signal):
+        """Arms the scan waveform, played on the scope's record clock."""
+        self.write(self.mode,signal)
+
+    def position(self,signal):
+        """Plays a positioning waveform and waits for the end of it."""
+        self.write('positioning',signal)
+        self.task.wait_until_done()
+
+    def close(self):
+        self.task.clear()
+
+# modes scanning a sequence of lines, stored and indexed like a volume
+PATTERNS = ('3D','radial','spiral','crosshair')
+
+def plays_volume(mode,config):
+    """Whether the whole trajectory of a pattern is played at once."""
+    return mode in PATTERNS and config[mode]['volume']
+
+def records_per_tomogram(mode,config):
+    """Records fetched for each tomogram, the flyback of a volume scan
+    included."""
+    if plays_volume(mode,config):
+        return config[mode]['numRecords'] + config[mode]['flyback']
+    return config[mode]['numRecords']
+
+def tomograms_per_fetch(mode,config):
+    """Tomograms fetched at once. Only volume scans, where the galvos need
+    no software step between tomograms, are batched."""
+    if plays_volume(mode,config):
+        return config[mode]['batch']
+    return 1
+
 def adjust_scope_config_to_scan(mode,config):
-    numRecords = config[mode]['numRecords']
+    if plays_volume(mode,config) and galvo_limits(config) is not None:
+        # the jerk limited flybacks take as long as the galvo limits require
+        config[mode]['flyback'] = volume_flyback(mode,config)
+    numRecords = records_per_tomogram(mode,config)*tomograms_per_fetch(mode,config)
     numPts = config[mode]['numPts']
     config['scope']['Horizontal']['numRecords'] = numRecords
     config['scope']['Horizontal']['numPts'] = numPts
 
-def configure_scope(mode,config):
-    try:
-        import niScope
-    except Exception:
-        print "niScope missing, continuing anyway"
+def volume_flyback(mode,config):
+    """Jerk limited flyback length of a volume scan, kept in the waveform
+    cache with the trajectories."""
+    cache = waveforms.get_cache(config['waveforms'])
+    geometry = dict(config[mode])
+    del geometry['flyback']
+    key = waveforms.key('flyback',mode,geometry,config['galvo'],
+        config['laser']['frequency'])
+    flyback = cache.get(key,lambda : [Path(config,mode).flyback_length()])
+    return int(flyback[0])
+
+def configure_scope(mode,config,Scope):
+    ch = config['VerticalSample']['channelList']
+    logger.info("Fetching channel: %s"%ch)
     def fetch(self,memory):
-        ch = config['VerticalSample']['channelList']
-        logger.info("Fetching channel: %s"%ch)
         self.Fetch(ch,memory)
-    niScope.Scope.fetch_sample_signal = fetch
-    scope = niScope.Scope(config['dev'])
+    Scope.fetch_sample_signal = fetch
+    scope = Scope(config['dev'])
     scope.ConfigureHorizontalTiming(**config['Horizontal'])
     scope.ExportSignal(**config['ExportSignal'])
     scope.ConfigureTrigger(**config['Trigger'])
@@ -144,20 +237,29 @@ def configure_scope(mode,config):
 def allocate_memory(mode,config):
     Xp = config[mode]['numLongPts']
     X = config[mode]['numPts']
-    Y = config[mode]['numRecords']
-    Z = config[mode]['numTomograms']
-    data =     [np.zeros([X ,Y],order='F',dtype=np.int32) for i in range(Z)]
-    data_p=    [np.zeros([Xp,Y],order='F',dtype=np.int32) for i in range(Z)]
+    Y = records_per_tomogram(mode,config)
+    B = tomograms_per_fetch(mode,config)
+    # a few fetches in flight, the consumer's policy handles the overflow
+    Z = min(-(-config[mode]['numTomograms']//B),config['fetch_buffers'])
+    dtype = config['scope']['dtype']
+    data =     [np.zeros([X ,Y*B],order='F',dtype=dtype) for i in range(Z)]
+    data_p=    [np.zeros([Xp,Y],order='F',dtype=dtype) for i in range(Z)]
     class Memory:
         def __init__(self,data,data_p,mode):
             self.i = 0 
             self.data = data
             self.data_p = data_p
             self.mode = mode
+            self.free = Queue.Queue()
+            for buffer in data:
+                self.free.put(buffer)
             self.next = {
                 'single':self.next_single,
                 'continuous':self.next_continuous,
                 '3D':self.next_3D,
+                'radial':self.next_3D,
+                'spiral':self.next_3D,
+                'crosshair':self.next_3D,
                     }[self.mode]
 
         def next_p(self):
@@ -171,63 +273,334 @@ def allocate_memory(mode,config):
 
         def next_3D(self):
             self.i += 1    
-            return self.data[self.i-1]
+            return self.data[(self.i-1)%len(self.data)]
 
         def next_single(self):
             return self.data[0]#,self.data_p
 
         def all(self):
             return self.data
+
+        def acquire(self,block=True):
+            """Free buffer to fetch a tomogram in. When they are all in
+            use, waits for one to be released, or returns None unless
+            block is set."""
+            try:
+                return self.free.get(block)
+            except Queue.Empty:
+                return None
+
+        def release(self,buffer):
+            self.free.put(buffer)
     return Memory(data,data_p,mode)
 
+def align_backward(tomogram,lag):
+    """Reverses in place a tomogram acquired on a backward sweep. The
+    galvos lagging lag records behind the waveform, possibly a fraction
+    of one, the reversed records are moved 2*lag records to line up with
+    the forward sweeps."""
+    backward = tomogram[:,::-1].copy()
+    if not lag:
+        tomogram[:] = backward
+        return tomogram
+    records = tomogram.shape[1]
+    source = np.clip(np.arange(records) - 2*lag,0,records - 1)
+    before = np.floor(source).astype(int)
+    after = np.minimum(before + 1,records - 1)
+    weight = source - before
+    aligned = backward[:,before]*(1 - weight) + backward[:,after]*weight
+    if tomogram.dtype.kind in 'iu':
+        aligned = np.rint(aligned)
+    tomogram[:] = aligned
+    return tomogram
+
+class Consumer(threading.Thread):
+    """Stores the fetched tomograms while the next ones are acquired. Each
+    tomogram updates the background estimate, is published in the live
+    ring and appended to the raw file when there is one, then its buffer
+    goes back to memory. A buffer holds a tomogram every `stride`
+    records, one per time stamp it is put with. Only the first `records`
+    records of each are stored, the others being the flyback of a volume
+    scan. When lag is given the scan is bidirectional: the odd tomograms,
+    counted from first, are reversed and aligned with align_backward.
+
+    When every buffer is still waiting to be stored, the policy decides:
+    'block' waits for one to be stored, 'drop_oldest' discards the oldest
+    waiting tomogram and reuses its buffer, 'drop_newest' fetches the new
+    tomogram in a spare buffer and discards it. Discarded tomograms are
+    counted in dropped, by tomogram.
+    """
+    def __init__(self,memory,writer,live,estimate=None,policy='block',
+            records=None,stride=None,lag=None,first=0):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.memory = memory
+        self.writer = writer
+        self.live = live
+        self.estimate = estimate
+        self.policy = policy
+        self.records = records
+        self.stride = stride
+        self.lag = lag
+        self.received = first
+        self.spare = np.zeros_like(memory.data[0])
+        self.pending = collections.deque()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.error = None
+        self.stored = 0
+        self.dropped = 0
+        self.timer = timing.Stages()
+        self.start()
+
+    def acquire(self):
+        """Buffer to fetch the next tomogram in."""
+        buffer = self.memory.acquire(self.policy == 'block')
+        if buffer is not None:
+            return buffer
+        if self.policy == 'drop_newest':
+            return self.spare
+        with self.condition:
+            if self.pending:
+                buffer, timestamps, first = self.pending.popleft()
+                self.dropped += len(timestamps)
+                return buffer
+        return self.memory.acquire()
+
+    def put(self,buffer,timestamps):
+        """Queues the tomograms fetched in buffer, given one time stamp or
+        one per tomogram."""
+        timestamps = np.atleast_1d(timestamps)
+        first = self.received
+        self.received += len(timestamps)
+        if buffer is self.spare:
+            self.dropped += len(timestamps)
+            return
+        with self.condition:
+            self.pending.append((buffer,timestamps,first))
+            self.condition.notify()
+
+    def tomogram(self,buffer,i):
+        start = i*(self.stride or 0)
+        stop = start + self.records if self.records else None
+        return buffer[:,start:stop]
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.join()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                buffer, timestamps, first = self.pending.popleft()
+            self.timer.skip()
+            try:
+                for i, timestamp in enumerate(timestamps):
+                    tomogram = self.tomogram(buffer,i)
+                    if self.lag is not None and (first + i)%2:
+                        align_backward(tomogram,self.lag)
+                        self.timer.lap('align')
+                    if self.estimate is not None:
+                        self.live.background[:] = self.estimate.update(tomogram)
+                        self.timer.lap('background')
+                    self.live.write(tomogram)
+                    self.timer.lap('ring')
+                    if self.writer is not None:
+                        self.writer.write(tomogram,timestamp)
+                        self.timer.lap('raw queue')
+                    self.stored += 1
+                    self.timer.frame()
+            except Exception, msg:
+                logger.exception(msg)
+                self.error = msg
+            self.memory.release(buffer)
+
 def scan_continuous(config,data):
     scan(config,data,'continuous')
 
 def scan_3D(config,data):
     scan(config,data,'3D')
 
+def resume_3D(config,data):
+    scan(config,data,'3D',resume=True)
+
+def scan_radial(config,data):
+    scan(config,data,'radial')
+
+def scan_spiral(config,data):
+    scan(config,data,'spiral')
+
+def scan_crosshair(config,data):
+    scan(config,data,'crosshair')
+
 def scan_single(config, data):
     return scan(config, data, 'single')
 
-def scan(config,data,mode):
+def move_to(daq,point,config,mode):
+    """Brings the galvos smoothly from the park position to point."""
+    start = np.zeros(2)
+    point = np.asarray(point,dtype=np.float64)
+    if np.allclose(point,start):
+        return
+    signal = make_return(start,point,config,mode)
+    daq.position(convert_path_to_voltage(signal,config['path_to_voltage']))
+
+def resumable(filename,config,mode,shape):
+    """Number of tomograms already in the raw file of an interrupted scan
+    with the same geometry, the file cut after the last indexed one."""
+    metadata = rawfile.read_header(filename)
+    if metadata['shape'] != list(shape) or metadata['geometry'] != dict(config[mode]):
+        raise ValueError("%s was acquired with another geometry."%filename)
+    return rawfile.resume(filename)
+
+def volume_waveform(path,mode,config):
+    """Voltages of the whole volume trajectory, checked against the
+    galvo limits."""
+    trajectory = path.make_volume_path()
+    galvo = config['galvo']
+    exceeded = exceeded_limits(trajectory,config['laser']['frequency'],
+        galvo['velocity'],galvo['acceleration'],galvo['jerk'])
+    if exceeded:
+        logger.warning("The %s trajectory exceeds the galvo %s limits, "
+            "lengthen the flyback or use the jerk_limited profile"%(mode,
+            ', '.join(exceeded)))
+    return convert_path_to_voltage(trajectory,config['path_to_voltage'])
+
+def scan(config,data,mode,resume=False):
     adjust_scope_config_to_scan(mode,config)
     memory = allocate_memory(mode,config)
-    scope = configure_scope(mode,config['scope'])
+    Scope, AnalogOutputTask = hardware(config)
+    scope = configure_scope(mode,config['scope'],Scope)
     path = Path(config,mode)
+    logger.info("Duty cycle %.1f%%"%(100*path.duty_cycle(
+        config['laser']['frequency'],config['daq']['positioning']['rate'])))
+    shape = (config[mode]['numPts'],config[mode]['numRecords'])
+    dtype = config['scope']['dtype']
+    live = ring.Ring(config['ring_file'],config['ring_slots'],shape,dtype)
+    estimate = background.make_background(config,shape[0])
 
     global interrupted
     interrupted = False
-    logger.info("Writing data in %s"%config['filename'])
-    with open(config['filename'],'w',0) as fd:
-        pickler = cPickle.Pickler(fd,cPickle.HIGHEST_PROTOCOL)
-        interrupt.signal(interrupt.SIGINT, signal_handler)
-        while path.has_next() and not interrupted:
-            tomogram = memory.next()
-            signal = convert_path_to_voltage(path.next(),config['path_to_voltage'])
-            daq = configure_daq(mode,config['daq'])
-            #need to test if array ordering is ok
-            daq.write(signal)
+    writer = None
+    done = 0
+    policy = 'block'
+    if mode == 'continuous':
+        policy = config[mode]['policy']
+    if mode != 'continuous' or config[mode]['save']:
+        logger.info("Writing data in %s"%config['filename'])
+        metadata = rawfile.describe(config,mode,shape,dtype)
+        if resume:
+            done = resumable(config['filename'],config,mode,shape)
+            logger.info("Resuming after %d tomograms"%done)
+            if done >= config[mode]['numTomograms']:
+                logger.info("%s is already complete"%config['filename'])
+                return None
+        writer = rawfile.AsyncWriter(config['filename'],metadata,
+                append=resume,index=mode in PATTERNS,**config['writer'])
+    path.seek(done)
+    batch = tomograms_per_fetch(mode,config)
+    lag = None
+    if config[mode].get('bidirectional'):
+        lag = config[mode]['lag']
+    consumer = Consumer(memory,writer,live,estimate,policy,shape[1],
+            records_per_tomogram(mode,config),lag,done)
+    daq = DaqSession(mode,config['daq'],AnalogOutputTask)
+    interrupt.signal(interrupt.SIGINT, signal_handler)
+    interrupt.signal(interrupt.SIGTERM, signal_handler)
+    volume = plays_volume(mode,config)
+    if done:
+        move_to(daq,path.scan_path.start(done),config,mode)
+    if volume:
+        # the whole volume is played once, a point per record
+        cache = waveforms.get_cache(config['waveforms'])
+        key = waveforms.key('volume',mode,config[mode],config['path_to_voltage'],
+            config['galvo'],config['laser']['frequency'])
+        trajectory = cache.get(key,lambda : volume_waveform(path,mode,config))
+        logger.info("Waveform cache: %(hits)d hits, %(loads)d loads, "
+            "%(misses)d computed"%cache.stats())
+        daq.scan(trajectory[done*records_per_tomogram(mode,config):])
+    timer = timing.Stages()
+    stats_file = config['timing']['stats_file']
+    start = reported = dumped = time()
+    buffer = None
+    count = 0
+    try:
+        while path.has_next() and not interrupted and consumer.error is None:
+            timer.skip()
+            buffer = consumer.acquire()
+            timer.lap('acquire')
+            count = 0
+            while count < batch and path.has_next():
+                signal = convert_path_to_voltage(path.next(),config['path_to_voltage'])
+                count += 1
+            timer.lap('path')
+            if not volume:
+                #need to test if array ordering is ok
+                daq.scan(signal)
+                timer.lap('daq write')
             try:
                 scope.InitiateAcquisition()
-                logger.debug("Std devition before fetch %.2e"%np.std(tomogram))
-                scope.fetch_sample_signal(tomogram)
-                logger.debug("Std devition after fetch %.2e"%np.std(tomogram))
-                pickler.dump(tomogram)
+                timer.lap('initiate')
+                began = time()
+                scope.fetch_sample_signal(buffer)
+                timer.lap('fetch')
+                # the tomograms of a batch are spread over the fetch
+                consumer.put(buffer,np.linspace(began,time(),count + 1)[1:])
+                timer.lap('queue')
             except Exception, msg:
                 logger.exception(msg)
-                del daq
-                signal = convert_path_to_voltage(path.next_return(),config['path_to_voltage'])
                 break
-            del daq
-            signal = convert_path_to_voltage(path.next_return(),config['path_to_voltage'])
-            move_daq(signal,config['daq'])
-        fd.close()
-        move_daq([0,0],config['daq'])
-        return tomogram
-
+            if consumer.dropped and time() - reported > 1:
+                logger.warning("%d tomograms dropped"%consumer.dropped)
+                reported = time()
+            if not volume:
+                target = path.next_return()
+                if target is not None:
+                    signal = convert_path_to_voltage(target,config['path_to_voltage'])
+                    daq.position(signal)
+                timer.lap('return')
+            timer.frame(count)
+            if stats_file and time() - dumped > config['timing']['interval']:
+                timer.dump(stats_file,stage='acquisition')
+                consumer.timer.dump(stats_file,stage='storage')
+                dumped = time()
+    finally:
+        daq.position(np.zeros((2,2)))
+        daq.close()
+        consumer.close()
+        if writer is not None:
+            writer.close()
+    elapsed = time() - start
+    logger.info("%d tomograms stored, %d dropped in %.2f s, %.1f tomograms/s"%(
+        consumer.stored, consumer.dropped, elapsed, consumer.stored/elapsed))
+    for line in timer.report():
+        logger.info("acquisition: %s"%line)
+    for line in consumer.timer.report():
+        logger.info("storage: %s"%line)
+    if stats_file:
+        timer.dump(stats_file,stage='acquisition')
+        consumer.timer.dump(stats_file,stage='storage')
+    if writer is not None:
+        logger.info("%(frames)d tomograms written at %(bandwidth).1f MB/s, "
+            "queue high water %(high_water)d of %(queue)d"%writer.stats())
+    if estimate is not None:
+        estimate.save(config['background']['file'])
+    if buffer is None:
+        return None
+    return consumer.tomogram(buffer,count - 1)
+
+
+def open_raw(config,data):
+    return rawfile.Volume(config['filename'])
 
 def resample_d(config,data):
-    if type(data) == list:
+    if type(data) == list or isinstance(data, rawfile.Volume):
         data = data[0]
     return resample(data, config)
 
@@ -244,13 +617,12 @@ def plot(config,data):
 
 def img_plot(config,data):
     print "ploting"
-    if type(data)== list:
+    if type(data)== list or isinstance(data, rawfile.Volume):
         data = data[0]
     if len(data.shape) == 2:
         data = data
     import matplotlib.pyplot as plt
-    length = data.shape[0]/2-1
-    plt.imshow(data[20:length])
+    plt.imshow(data[20:])
     plt.show()
 
 def store(config,data):
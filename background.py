@@ -0,0 +1,37 @@
+import numpy as np
+
+class Background:
+    """Per sample estimate of the background spectrum, updated with every
+    tomogram as it is acquired. 'mean' averages every record seen so far,
+    'ewma' weights the mean record of each new tomogram by alpha.
+    """
+    def __init__(self, num_pts, mode='mean', alpha=0.05):
+        self.mode = mode
+        self.alpha = alpha
+        self.spectrum = np.zeros(num_pts)
+        self.record_mean = np.zeros(num_pts)
+        self.count = 0
+
+    def update(self, tomogram):
+        """Updates the estimate with a (numPts, numRecords) tomogram."""
+        np.mean(tomogram, axis=1, out=self.record_mean)
+        self.count += 1
+        if self.mode == 'ewma' and self.count > 1:
+            weight = self.alpha
+        else:
+            weight = 1.0/self.count
+        self.record_mean -= self.spectrum
+        self.record_mean *= weight
+        self.spectrum += self.record_mean
+        return self.spectrum
+
+    def save(self, filename):
+        np.save(filename, self.spectrum)
+
+def make_background(config, num_pts):
+    """Background estimate configured in [background], None when the
+    background is not estimated."""
+    settings = config['background']
+    if settings['mode'] == 'none':
+        return None
+    return Background(num_pts, settings['mode'], settings['alpha'])
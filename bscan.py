@@ -0,0 +1,192 @@
+import numpy as np
+from scipy import fftpack
+import resampler
+
+def depth_window(config):
+    """(start, stop) of the depth bins kept after the transform, stop is
+    None to keep up to the end of the non-redundant half."""
+    processing = config.get('processing', {})
+    start = processing.get('depth_start', 0)
+    stop = processing.get('depth_stop', 0)
+    return start, stop or None
+
+def depth_slice(num_pts, depth=None):
+    """Slice of the non-redundant half of the spectrum of num_pts real
+    samples, optionally cropped to depth=(start, stop)."""
+    start, stop = depth if depth else (0, None)
+    return slice(*slice(start, stop).indices(num_pts//2))
+
+def transform_shape(shape, depth=None, axis=-1):
+    shape = list(shape)
+    window = depth_slice(shape[axis], depth)
+    shape[axis] = len(range(window.start, window.stop))
+    return tuple(shape)
+
+def allocate_transform(shape, depth=None, axis=-1):
+    return np.zeros(transform_shape(shape, depth, axis))
+
+def transform(rsp_data, out=None, depth=None, axis=-1):
+    """Magnitude of the depth profile of real spectra along axis. Only the
+    non-redundant half of the spectrum is kept, written into out when it
+    is given (see allocate_transform)."""
+    spectrum = np.fft.rfft(rsp_data, axis=axis)
+    index = [slice(None)]*spectrum.ndim
+    index[axis] = depth_slice(rsp_data.shape[axis], depth)
+    return np.absolute(spectrum[tuple(index)], out=out)
+
+# Single precision is plenty for an 8 bit image and halves the memory
+# traffic of every stage.
+SCRATCH = np.float32
+
+# Bytes of spectra run through consecutive stages while they are in cache.
+BLOCK_SIZE = 2**18
+
+def transform_dtype(num_pts):
+    """scipy.fftpack only transforms single precision spectra in place when
+    their length factors into 2, 3 and 5, saving the Kernel a copy."""
+    for factor in (2, 3, 5):
+        while num_pts%factor == 0:
+            num_pts //= factor
+    return SCRATCH if num_pts == 1 else np.float64
+
+WINDOWS = {
+    'none': np.ones,
+    'hann': np.hanning,
+    }
+
+def settings(config):
+    """The part of the configuration a Kernel depends on."""
+    processing = config.get('processing', {})
+    return (
+        processing.get('resample_pts', 0),
+        processing.get('window', 'none'),
+        processing.get('db', False),
+        depth_window(config),
+        )
+
+def image_shape(shape, config):
+    """Shape of the image a Kernel makes out of frames of the given shape."""
+    lines, num_pts = shape
+    num_rsp, window, db, depth = settings(config)
+    depth_window = depth_slice(num_rsp or num_pts, depth)
+    return lines, depth_window.stop - depth_window.start
+
+class Kernel:
+    """Fused processing of raw B-scans, one spectrum per row, into display
+    ready uint8 images: resampling, window, transform, magnitude, dB
+    compression, brightness/contrast and clipping.
+
+    All intermediate results live in scratch buffers allocated with the
+    kernel, so processing a stream of frames of the same shape does not
+    allocate. The window is folded into the resampling weights and the
+    transform is done in place on the resampled spectra.
+    """
+    def __init__(self, shape, config):
+        lines, num_pts = shape
+        num_rsp, window, self.db, depth = settings(config)
+        self.shape = shape
+        if num_rsp:
+            plan = resampler.make_resampler(config, num_pts, num_rsp)
+            self.indices = [np.ascontiguousarray(i) for i in plan.indices.T]
+            weights = plan.weights*WINDOWS[window](num_rsp)[:,np.newaxis]
+            self.weights = [SCRATCH(w[:,np.newaxis]) for w in weights.T]
+            # gathering whole rows is much faster than gathering columns
+            self.samples = np.zeros((num_pts,lines), dtype=SCRATCH)
+            self.gathered = np.zeros((num_rsp,lines), dtype=SCRATCH)
+            self.sum = np.zeros((num_rsp,lines), dtype=SCRATCH)
+        else:
+            num_rsp = num_pts
+            self.indices = None
+            self.window = SCRATCH(WINDOWS[window](num_pts))
+            rows = BLOCK_SIZE//(num_pts*np.dtype(SCRATCH).itemsize)
+            self.blocks = [slice(i, i + max(rows, 1))
+                    for i in range(0, lines, max(rows, 1))]
+        precision = transform_dtype(num_rsp)
+        self.rsp = np.zeros((lines,num_rsp), dtype=precision)
+        self.depth = depth_slice(num_rsp, depth)
+        start, stop = self.depth.start, self.depth.stop
+        self.magnitude = np.zeros((lines,stop - start), dtype=precision)
+        self.image = np.zeros(self.magnitude.shape, dtype=np.uint8)
+        # rfft in scipy.fftpack packs the spectrum as
+        # [y(0), Re y(1), Im y(1), ..., Re y(n/2)]
+        self.dc = start == 0
+        first = max(start, 1)
+        self.re = self.rsp[:,2*first - 1:2*stop - 1:2]
+        self.im = self.rsp[:,2*first:2*stop:2]
+        self.ac = self.magnitude[:,int(self.dc):]
+        self.im_squared = np.zeros(self.ac.shape, dtype=precision)
+
+    def resample(self, data, background=None):
+        """Resampled and windowed spectra, written in self.rsp. The
+        background is subtracted while converting the samples."""
+        if self.indices is None:
+            if background is None:
+                np.multiply(data, self.window, out=self.rsp)
+            else:
+                # a single pass over the frame, a block at a time
+                for block in self.blocks:
+                    rsp = self.rsp[block]
+                    np.subtract(data[block], background, out=rsp)
+                    np.multiply(rsp, self.window, out=rsp)
+            return
+        if background is None:
+            np.copyto(self.samples, data.T)
+        else:
+            np.subtract(data.T, background[:,np.newaxis], out=self.samples)
+        gathered, total = self.gathered, self.sum
+        for k, (index, weight) in enumerate(zip(self.indices, self.weights)):
+            np.take(self.samples, index, axis=0, out=gathered, mode='clip')
+            if k == 0:
+                np.multiply(gathered, weight, out=total)
+            else:
+                np.multiply(gathered, weight, out=gathered)
+                np.add(total, gathered, out=total)
+        np.copyto(self.rsp.T, total)
+
+    def power(self):
+        """Squared magnitude of the transform within the depth window."""
+        magnitude = self.magnitude
+        if self.dc:
+            np.multiply(self.rsp[:,0], self.rsp[:,0], out=magnitude[:,0])
+        np.multiply(self.re, self.re, out=self.ac)
+        np.multiply(self.im, self.im, out=self.im_squared)
+        np.add(self.ac, self.im_squared, out=self.ac)
+        return magnitude
+
+    def __call__(self, data, parameters, out=None, background=None):
+        """Processes data into out, or into the kernel's own image buffer
+        which is overwritten by the next call. background is a spectrum
+        subtracted from every row of data."""
+        if out is None:
+            out = self.image
+        self.resample(data, background)
+        spectrum = fftpack.rfft(self.rsp, overwrite_x=True)
+        if spectrum is not self.rsp:
+            np.copyto(self.rsp, spectrum)
+        magnitude = self.power()
+        brightness = parameters['brightness']
+        contrast = parameters['contrast']
+        if self.db:
+            with np.errstate(divide='ignore'):
+                np.log10(magnitude, out=magnitude)
+            np.multiply(magnitude, 10*contrast, out=magnitude)
+            np.add(magnitude, brightness*contrast, out=magnitude)
+        else:
+            np.sqrt(magnitude, out=magnitude)
+            np.add(magnitude, brightness, out=magnitude)
+            np.multiply(magnitude, contrast, out=magnitude)
+        np.clip(magnitude, 0, 255, out=magnitude)
+        np.copyto(out, magnitude, casting='unsafe')
+        return out
+
+kernels = {}
+
+def get_kernel(data, config):
+    """Kernel for frames shaped like data, rebuilt when the processing
+    settings, the resampling kind or the calibration change."""
+    key = (data.shape, settings(config),
+            config.get('resample_kind', 'cubic'), resampler.calibration(config))
+    if key not in kernels:
+        kernels.clear()
+        kernels[key] = Kernel(data.shape, config)
+    return kernels[key]
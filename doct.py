@@ -9,6 +9,11 @@ flags = [
     'scan-continuous',
     'scan-single',
     'scan-3D',
+    'resume-3D',
+    'scan-radial',
+    'scan-spiral',
+    'scan-crosshair',
+    'open-raw',
     'x',
     'get-p',
     'resample-d',
@@ -0,0 +1,125 @@
+import logging
+import threading
+import Queue
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Bytes per chunk of the tomogram dataset.
+CHUNK_SIZE = 2**20
+
+def chunk_shape(shape, dtype):
+    """Chunks of a (numTomograms, lines, depth) dataset of images of the
+    given (lines, depth) shape. Chunks span all the lines of as many
+    tomograms as depths, so reading a tomogram and reading an en face
+    plane touch about as many extra bytes."""
+    lines, depth = shape
+    rows = int(np.sqrt(CHUNK_SIZE/float(lines*np.dtype(dtype).itemsize)))
+    rows = max(1, min(rows, depth))
+    return (rows, lines, rows)
+
+def attributes(section, prefix=''):
+    """Flattens a configuration into 'section/key' HDF5 attributes."""
+    flat = {}
+    for key, value in section.items():
+        name = prefix + key
+        if isinstance(value, dict):
+            flat.update(attributes(value, name + '/'))
+        elif isinstance(value, (list, tuple)):
+            flat[name] = np.array(value)
+        elif value is not None:
+            flat[name] = value
+    return flat
+
+def dataset_name(fd):
+    """First free name of 'tomograms', 'tomograms_1', 'tomograms_2'..."""
+    name = 'tomograms'
+    number = 0
+    while name in fd:
+        number += 1
+        name = 'tomograms_%d'%number
+    return name
+
+class TomogramWriter(threading.Thread):
+    """Appends processed B-scans to a chunked dataset of an HDF5 file from
+    a thread of its own. put only blocks when more than queue_size images
+    are waiting to be written. The file is created in mode 'w', in mode
+    'a' the images go to a new dataset next to those already in it, as
+    when the tomogram shape changes during a stream.
+
+    An error of the writing thread is raised by the following put or
+    close.
+    """
+    def __init__(self, filename, shape, dtype=np.uint8, config=None,
+            compression=None, queue_size=64, mode='w'):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.filename = filename
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.config = config or {}
+        self.compression = None if compression == 'none' else compression
+        self.mode = mode
+        self.queue = Queue.Queue(queue_size)
+        self.count = 0
+        self.dataset = None
+        self.error = None
+        self.start()
+
+    def check(self):
+        if self.error is not None:
+            raise self.error
+        if not self.is_alive():
+            raise RuntimeError("%s is not being written."%self.filename)
+
+    def put(self, image):
+        while True:
+            self.check()
+            try:
+                self.queue.put(image, timeout=0.1)
+                return
+            except Queue.Full:
+                pass
+
+    def close(self):
+        """Writes the remaining images and closes the file."""
+        self.put(None)
+        self.join()
+        if self.error is not None:
+            raise self.error
+
+    def run(self):
+        try:
+            self.write()
+        except Exception, msg:
+            logger.exception(msg)
+            self.error = msg
+
+    def write(self):
+        import h5py
+        chunks = chunk_shape(self.shape, self.dtype)
+        batch = np.zeros(chunks[:1] + self.shape, self.dtype)
+        with h5py.File(self.filename, self.mode) as fd:
+            self.dataset = dataset_name(fd)
+            dataset = fd.create_dataset(self.dataset, (0,) + self.shape,
+                    self.dtype, maxshape=(None,) + self.shape, chunks=chunks,
+                    compression=self.compression)
+            for name, value in attributes(self.config).items():
+                dataset.attrs[name] = value
+            done = False
+            while not done:
+                # write whole chunks of tomograms at once
+                filled = 0
+                while filled < len(batch):
+                    image = self.queue.get()
+                    if image is None:
+                        done = True
+                        break
+                    batch[filled] = image
+                    filled += 1
+                if filled:
+                    dataset.resize(self.count + filled, axis=0)
+                    dataset[self.count:self.count + filled] = batch[:filled]
+                    self.count += filled
+                    logger.debug("%d tomograms written to %s"%(
+                        self.count, self.filename))
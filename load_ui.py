@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 import sys, subprocess, cPickle, numpy as np, Image, tempfile, os, logging
 import processor
+import pool
+import ring
+import h5writer
 from configobj import ConfigObj
 from PyQt4 import QtCore, QtGui, uic
 #from PyQt4.QtGui import QAction, QMainWindow, QWidget, QApplication, qApp, QIcon, QTextEdit, QMenu, QGridLayout, QPushButton, QGraphicsView, QGraphicsScene, qBlue, QPen, QRadioButton, QGroupBox, QButtonGroup, QPixmap, QSizePolicy, QPainter, QFont, QFrame, QPallete
@@ -53,23 +56,84 @@ class AcquirerProcessor(QtCore.QThread):
         self.config = parent.config
         QtCore.QThread.__init__(self, parent)
 
+    def open_ring(self):
+        filename = self.config['ring_file']
+        logger.debug("data_collector is waiting for %s."%filename)
+        while not os.path.exists(filename):
+            self.msleep(100)
+        frames = ring.Ring(filename)
+        self.buffer = np.zeros(frames.shape, frames.dtype, order='F')
+        self.background = np.zeros(frames.shape[0])
+        return frames
+
     def run(self):
-        filename = self.config['raw_file']
-        self.fd = open(filename)
-        logger.debug("Creating unpickler")
-        self.unpickler = cPickle.Unpickler(self.fd)
+        self.frames = self.open_ring()
+        self.pool = None
+        self.writer = None
+        self.streamed = False
         while True:
             try:
-                logger.debug("data_collector is waiting for data.")
-                self.data = self.unpickler.load()
-            except EOFError, e:
-                logger.debug("End of file.")
-                self.fd.close()
-                return
+                frame = self.frames.read(self.buffer)
+            except ring.Overrun, e:
+                logger.debug(e)
+                continue
+            if frame is None:
+                self.emit_results()
+                if self.frames.replaced():
+                    self.frames = self.open_ring()
+                self.msleep(5)
+                continue
+            sequence, timestamp, self.data = frame
             self.prev = self.data
             logger.debug("std dev %.2e"%np.std(self.data))
-            parameters = {"brightness":-00, "contrast":2}
-            self.data = processor.process(self.data, parameters, self.config)
+            # the kernel wants one spectrum per row
+            data = self.data.T
+            if self.pool is None or self.pool.inputs.shape[1:] != data.shape:
+                self.start_pool(data)
+            background = None
+            if self.config['background']['mode'] != 'none':
+                background = self.background
+                background[:] = self.frames.background
+            self.pool.put(data, self.config['processing'], background)
+            self.emit_results()
+            logger.debug("Processing pool %s, %d frames dropped"%(
+                self.pool.stats(), self.frames.dropped))
+
+    def start_pool(self, data):
+        if self.pool is not None:
+            self.emit_results(block=True)
+            self.pool.close()
+        if self.writer is not None:
+            self.close_writer()
+        workers = self.config['processing']['workers']
+        self.pool = pool.ProcessingPool(self.config, data.shape, data.dtype,
+                workers)
+        save = self.config['save']
+        if save['stream']:
+            # after a shape change the stream goes on in a new dataset
+            mode = 'a' if self.streamed else 'w'
+            self.writer = h5writer.TomogramWriter(save['filename'],
+                    self.pool.outputs.shape[1:], config=self.config,
+                    compression=save['compression'], mode=mode)
+            self.streamed = True
+
+    def close_writer(self):
+        try:
+            self.writer.close()
+        except Exception, msg:
+            logger.error("Streaming to %s failed: %s"%(self.writer.filename, msg))
+        self.writer = None
+
+    def emit_results(self, block=False):
+        if self.pool is None:
+            return
+        for self.data in self.pool.results(block):
+            if self.writer is not None:
+                try:
+                    self.writer.put(self.data)
+                except Exception, msg:
+                    logger.error("Streaming stopped: %s"%msg)
+                    self.writer = None
             logger.debug("Emitting data ready to showing")
             logger.debug("std dev processed %.2e"%np.std(self.data))
             self.emit(QtCore.SIGNAL("data_ready(PyQt_PyObject)"), self.data)
@@ -284,12 +348,13 @@ class OCT (QtGui.QMainWindow, form_class):
         return self.camera_scene.addRect(QRectF(start, end))
 
     def save_processed_data(self, filename):
-        import h5py
-        file = h5py.File(filename, 'w')
-        root = file.create_group("root")
-        for i, image in enumerate(self.processed_data):
-            root.create_dataset('image_%03d'%i, image.shape, image.dtype) 
-        file.close()
+        if not self.processed_data:
+            return
+        writer = h5writer.TomogramWriter(filename, self.processed_data[0].shape,
+                config=self.config, compression=self.config['save']['compression'])
+        for image in self.processed_data:
+            writer.put(image)
+        writer.close()
 
     def plot_in_tomography_view(self, data):
         self.current_tomography_data = data
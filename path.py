@@ -1,4 +1,5 @@
 import numpy as np
+import collections
 from path import *
 
 def poly3(x1,x2,t1,t2,r1,r2):
@@ -32,8 +33,8 @@ def make_return_3D_path(x0,xf,y0,yf,tf,r,N,numTomograms):
     path_x = path*np.ones(numTomograms)
     path_x = path_x.T
     y = np.linspace(y0,yf,numTomograms)
-    intervals = [[y[i],y[i+1]] for i in range(numTomograms-1)]+[[y[-1]]*2]
-    path_y = np.vstack([np.linspace(i[0],i[1],N) for i in intervals])
+    step = np.append(np.diff(y),0)
+    path_y = y[:,None] + step[:,None]*np.linspace(0,1,N)
     p = np.dstack((path_x,path_y))
     return p
 
@@ -79,6 +80,46 @@ def make_scan_3D_path(x0,y0,xf,yf,numTomograms,numRecords):
     scan_path = np.dstack([X,Y])
     return scan_path
 
+def join_lines(lines,flyback,closed=False):
+    """
+    Trajectory playing (numLines, numRecords, 2) lines one after the
+    other, one point per record. Every line is followed by a cubic flyback
+    of flyback points to the start of the next one, leaving and joining
+    the lines at their speed. The last line flies back to the start of the
+    first one when closed, to its own start otherwise.
+    """
+    lines = np.asarray(lines,dtype=np.float64)
+    if lines.shape[1] > 1:
+        velocity = lines[:,1] - lines[:,0]
+        end_velocity = lines[:,-1] - lines[:,-2]
+    else:
+        velocity = end_velocity = np.zeros((len(lines),2))
+    following = np.arange(1,len(lines) + 1)
+    following[-1] = 0 if closed else len(lines) - 1
+    p0, v0 = lines[:,-1], end_velocity
+    p1, v1 = lines[following,0], velocity[following]
+    # cubic Hermite segments, time counted in records
+    T = flyback + 1.
+    s = (np.arange(1,flyback + 1)/T)[None,:,None]
+    h00 = 2*s**3 - 3*s**2 + 1
+    h10 = s**3 - 2*s**2 + s
+    h01 = -2*s**3 + 3*s**2
+    h11 = s**3 - s**2
+    segments = h00*p0[:,None] + h10*T*v0[:,None] + h01*p1[:,None] + h11*T*v1[:,None]
+    return np.concatenate((lines,segments),axis=1).reshape(-1,2)
+
+def make_volume_path(x0,y0,xf,yf,numTomograms,numRecords,flyback,
+        bidirectional=False):
+    """
+    Trajectory of a whole 3D scan, so the galvos can play the volume in
+    one go. Bidirectional scans play the odd lines backwards, the flyback
+    only turning the galvos round.
+    """
+    lines = make_scan_3D_path(x0,y0,xf,yf,numTomograms,numRecords)
+    if bidirectional:
+        lines[1::2] = lines[1::2,::-1].copy()
+    return join_lines(lines,flyback)
+
 def time_taken(p0,pm,acc):
     """time taken to go from p0 to pm under acceleration acc.
     Starting from rest."""
@@ -104,42 +145,376 @@ def smooth_return(p0,pf,acc):
     acc = acc_necessary(p0,pm,tmax)
     return np.ascontiguousarray(path(p0,pf,acc,tmax).T)
 
+def speed_ramp(speed,acceleration,jerk):
+    """Phases (Tj, Ta) of the fastest rise from rest to speed with bounded
+    acceleration and jerk, see s_curve."""
+    if speed*jerk >= acceleration**2:
+        Tj = acceleration/jerk
+        Ta = Tj + speed/acceleration
+    else:
+        Tj = np.sqrt(speed/jerk)
+        Ta = 2*Tj
+    return Tj, Ta
+
+def s_curve(distance,velocity,acceleration,jerk):
+    """
+    Phases (Tj, Ta, Tv) of the fastest move over distance from rest to
+    rest with bounded velocity, acceleration and jerk: the acceleration
+    lasts Ta and ramps up and down in Tj, the speed stays constant for
+    Tv, then the deceleration mirrors the acceleration.
+    """
+    distance = abs(distance)
+    Tj, Ta = speed_ramp(velocity,acceleration,jerk)
+    Tv = distance/velocity - Ta
+    if Tv < 0:
+        # the top speed is not reached
+        Tv = 0.
+        if distance >= 2*acceleration**3/jerk**2:
+            Tj = acceleration/jerk
+            Ta = Tj/2 + np.sqrt(Tj**2/4 + distance/acceleration)
+        else:
+            Tj = (distance/(2*jerk))**(1/3.)
+            Ta = 2*Tj
+    return Tj, Ta, Tv
+
+def s_curve_positions(t,phases,jerk):
+    """Distance covered at times t by a move of the given s_curve phases."""
+    Tj, Ta, Tv = phases
+    durations = np.array([Tj,Ta - 2*Tj,Tj,Tv,Tj,Ta - 2*Tj,Tj])
+    jerks = jerk*np.array([1,0,-1,0,-1,0,1])
+    starts = np.append(0,np.cumsum(durations))
+    states = np.zeros((7,3))
+    p = v = a = 0.
+    for k, (d, j) in enumerate(zip(durations,jerks)):
+        states[k] = p, v, a
+        p += v*d + a*d**2/2 + j*d**3/6
+        v += a*d + j*d**2/2
+        a += j*d
+    k = np.clip(np.searchsorted(starts,t,'right') - 1,0,6)
+    dt = t - starts[k]
+    p, v, a = states[k].T
+    return p + v*dt + a*dt**2/2 + jerks[k]*dt**3/6
+
+def limits_along(direction,velocity,acceleration,jerk):
+    """Velocity, acceleration and jerk bounds of a straight move in
+    direction, a unit vector, set by the axis moving most."""
+    direction = np.abs(direction)
+    with np.errstate(divide='ignore'):
+        return [np.min(np.asarray(limit,dtype=np.float64)/direction)
+            for limit in (velocity,acceleration,jerk)]
+
+def exceeded_limits(path,rate,velocity,acceleration,jerk):
+    """Names of the galvo limits a path played at rate goes over."""
+    exceeded = []
+    for order, (name, limit) in enumerate(zip(
+            ('velocity','acceleration','jerk'),(velocity,acceleration,jerk))):
+        derivative = np.diff(path,order + 1,axis=0)*rate**(order + 1)
+        if np.any(np.abs(derivative) > np.asarray(limit)*(1 + 1e-6)):
+            exceeded.append(name)
+    return exceeded
+
+def jerk_limited_return(p0,pf,velocity,acceleration,jerk,rate):
+    """
+    Fastest straight move of the galvos from rest at p0 to rest at pf,
+    sampled at rate, with the velocity, acceleration and jerk of each
+    axis bounded. The limits are in path units per second, per second
+    squared and cubed, for both axes or one per axis.
+    """
+    p0 = np.asarray(p0,dtype=np.float64)
+    pf = np.asarray(pf,dtype=np.float64)
+    step = pf - p0
+    distance = np.sqrt(np.sum(step**2))
+    if distance == 0:
+        return np.vstack((p0,pf))
+    limits = limits_along(step/distance,velocity,acceleration,jerk)
+    phases = s_curve(distance,*limits)
+    duration = 2*phases[1] + phases[2]
+    t = np.linspace(0,duration,int(np.ceil(duration*rate)) + 1)
+    s = s_curve_positions(t,phases,limits[2])/distance
+    path = p0 + s[:,None]*step
+    path[-1] = pf
+    return np.ascontiguousarray(path)
+
+def make_return(p0,pf,config,mode):
+    """
+    Galvo move from p0 to pf played on the positioning clock, with the
+    profile of [galvo]: constant acceleration acc of the mode, in path
+    units per sample squared, or jerk limited with the galvo limits.
+    """
+    limits = galvo_limits(config)
+    if limits is None:
+        if np.allclose(p0,pf):
+            return np.vstack((p0,pf)).astype(np.float64)
+        return smooth_return(p0,pf,config[mode]['acc'])
+    return jerk_limited_return(p0,pf,*limits,
+        rate=config['daq']['positioning']['rate'])
+
+def galvo_limits(config):
+    """Velocity, acceleration and jerk limits of [galvo], None unless its
+    profile is jerk limited."""
+    galvo = config.get('galvo')
+    if galvo is None or galvo['profile'] == 'constant_acceleration':
+        return None
+    return galvo['velocity'], galvo['acceleration'], galvo['jerk']
+
+def run_up(point,velocity,limits,rate):
+    """
+    Points, sampled at rate, of the fastest jerk limited straight run up
+    from rest to point, reached at velocity in path units per second.
+    The first point is at rest, point itself is left out.
+    """
+    speed = np.sqrt(np.sum(velocity**2))
+    if speed == 0:
+        return np.empty((0,2))
+    direction = velocity/speed
+    bound, acceleration, jerk = limits_along(direction,*limits)
+    if speed > bound*(1 + 1e-6):
+        raise ValueError("Lines scanned at %g per second are beyond the "
+            "galvo velocity limit of %g."%(speed,bound))
+    Tj, Ta = speed_ramp(speed,acceleration,jerk)
+    before = np.arange(int(np.ceil(Ta*rate)),0,-1)/float(rate)
+    covered = s_curve_positions(np.maximum(Ta - before,0),(Tj,Ta,0.),jerk)
+    return point - direction*(speed*Ta/2 - covered)[:,None]
+
+def flyback_parts(line,following,limits,rate):
+    """
+    Jerk limited flyback played at rate from the end of line to the
+    start of following, as the slowing down and move to the run up
+    point, then the run up. The lines are left and joined at their
+    speed, any wait between the parts is at rest.
+    """
+    def velocity(points):
+        if len(points) < 2:
+            return np.zeros(2)
+        return (points[1] - points[0])*rate
+    # slowing down is a run up to the end of the line played backwards
+    slow_down = run_up(line[-1],velocity(line[:-3:-1]),limits,rate)[::-1]
+    speed_up = run_up(following[0],velocity(following),limits,rate)
+    stop = slow_down[-1] if len(slow_down) else line[-1]
+    start = speed_up[0] if len(speed_up) else following[0]
+    move = jerk_limited_return(stop,start,*limits,rate=rate)[1:-1]
+    return np.concatenate((slow_down,move)), speed_up
+
+def join_lines_limited(lines,limits,rate,closed=False):
+    """
+    Trajectory playing lines like join_lines, the flybacks made of
+    flyback_parts and as long as the longest of them, the others waiting
+    at rest before their run up. Returns the trajectory and the flyback
+    length.
+    """
+    lines = [np.asarray(line,dtype=np.float64) for line in lines]
+    following = range(1,len(lines)) + [0 if closed else len(lines) - 1]
+    parts = [flyback_parts(line,lines[k],limits,rate)
+        for line, k in zip(lines,following)]
+    flyback = max(len(head) + len(tail) for head, tail in parts)
+    pieces = []
+    for line, k, (head, tail) in zip(lines,following,parts):
+        start = tail[0] if len(tail) else lines[k][0]
+        wait = np.tile(start,(flyback - len(head) - len(tail),1))
+        pieces.extend((line,head,wait,tail))
+    return np.concatenate(pieces), flyback
+
+class Pattern:
+    """
+    Lines of a scan, one per tomogram, each computed by line(i) when
+    indexed.
+    """
+    def __init__(self,count):
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def start(self,i):
+        return self[i][0]
+
+    def moves(self,closed):
+        """
+        Moves between lines as (i, k, n): from line i to line k, standing
+        for n moves alike. Each line is followed by the next, the last
+        one by the first when closed, by itself otherwise.
+        """
+        following = range(1,self.count) + [0 if closed else self.count - 1]
+        return [(i,k,1) for i, k in enumerate(following)]
+
+    def __getitem__(self,i):
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError("Line %d of a %d lines scan."%(i,self.count))
+        return self.line(i)
+
+class Lines(Pattern):
+    """
+    Raster of a 3D scan. Line i goes from (x0,y) to (xf,y), y being spread
+    evenly from y0 for the first line to yf for the last. The odd lines go
+    back from xf to x0 when bidirectional.
+    """
+    def __init__(self,x0,y0,xf,yf,numTomograms,numRecords,bidirectional=False):
+        Pattern.__init__(self,numTomograms)
+        self.x = np.linspace(x0,xf,numRecords)
+        self.y0 = y0
+        self.pitch = (yf - y0)/float(max(numTomograms - 1,1))
+        self.bidirectional = bidirectional
+
+    def moves(self,closed):
+        """Moves between lines as Pattern.moves, those between the
+        sweeps of a parity being alike."""
+        last = self.count - 1
+        if closed or last == 0:
+            return Pattern.moves(self,closed)
+        if self.bidirectional:
+            moves = [(0,1,(last + 1)//2),(1,2,last//2)]
+        else:
+            moves = [(0,1,last)]
+        return [move for move in moves if move[2]] + [(last,last,1)]
+
+    def sweep(self,i):
+        if self.bidirectional and i%2:
+            return self.x[::-1]
+        return self.x
+
+    def start(self,i):
+        return np.array([self.sweep(i)[0],self.y0 + i*self.pitch])
+
+    def line(self,i):
+        line = np.empty((len(self.x),2))
+        line[:,0] = self.sweep(i)
+        line[:,1] = self.y0 + i*self.pitch
+        return line
+
+def centre_and_radius(x0,y0,xf,yf):
+    """Centre of the region and radius of the largest circle in it."""
+    centre = np.array([(x0 + xf)/2.,(y0 + yf)/2.])
+    return centre, min(abs(xf - x0),abs(yf - y0))/2.
+
+class Radial(Pattern):
+    """
+    Diameters of the largest circle centred in the region, diameter i
+    turned by i/numTomograms of a half turn.
+    """
+    def __init__(self,x0,y0,xf,yf,numTomograms,numRecords):
+        Pattern.__init__(self,numTomograms)
+        self.centre, radius = centre_and_radius(x0,y0,xf,yf)
+        self.t = np.linspace(-radius,radius,numRecords)[:,None]
+
+    def line(self,i):
+        angle = np.pi*i/self.count
+        return self.centre + self.t*[np.cos(angle),np.sin(angle)]
+
+class Spiral(Pattern):
+    """
+    Archimedean spirals of the given number of turns from the centre of
+    the region to the largest circle in it, with points evenly spaced
+    along the curve. Spiral i is turned by i/numTomograms of a turn.
+    """
+    def __init__(self,x0,y0,xf,yf,numTomograms,numRecords,turns):
+        Pattern.__init__(self,numTomograms)
+        self.centre, radius = centre_and_radius(x0,y0,xf,yf)
+        # the angles at even steps of the arc length of r = a*theta
+        last = 2*np.pi*turns
+        a = radius/last
+        theta = np.linspace(0,last,16*numRecords)
+        arc = a/2*(theta*np.sqrt(1 + theta**2) + np.arcsinh(theta))
+        self.angle = np.interp(np.linspace(0,arc[-1],numRecords),arc,theta)
+        self.radius = a*self.angle[:,None]
+
+    def line(self,i):
+        angle = self.angle + 2*np.pi*i/self.count
+        return self.centre + self.radius*np.column_stack((np.cos(angle),np.sin(angle)))
+
+class Crosshair(Pattern):
+    """
+    Horizontal and vertical lines through the centre of the region, in
+    turn.
+    """
+    def __init__(self,x0,y0,xf,yf,numTomograms,numRecords):
+        Pattern.__init__(self,numTomograms)
+        centre, radius = centre_and_radius(x0,y0,xf,yf)
+        horizontal = np.empty((numRecords,2))
+        horizontal[:,0] = np.linspace(x0,xf,numRecords)
+        horizontal[:,1] = centre[1]
+        vertical = np.empty((numRecords,2))
+        vertical[:,0] = centre[0]
+        vertical[:,1] = np.linspace(y0,yf,numRecords)
+        self.lines = (horizontal,vertical)
+
+    def line(self,i):
+        return self.lines[i%2].copy()
+
+    def moves(self,closed):
+        """Moves between lines as Pattern.moves, those between lines
+        of the same directions being alike."""
+        alike = collections.OrderedDict()
+        for i, k, n in Pattern.moves(self,closed):
+            kind = (i%2,k%2,i == k)
+            if kind in alike:
+                alike[kind][2] += 1
+            else:
+                alike[kind] = [i,k,1]
+        return [tuple(move) for move in alike.values()]
+
 class Path:
+    # the sweeps of a bidirectional scan go forth and back in turn
+    bidirectional = False
+    volume = False
+
     def __init__(self,config,mode="single"):
         for key,value in config[mode].iteritems():
             setattr(self,key,value)
+        self.mode = mode
+        self.config = config
         self.i = 0 
         self.next = {
             '3D':self.next_3D,
+            'radial':self.next_3D,
+            'spiral':self.next_3D,
+            'crosshair':self.next_3D,
             'single':self.next_single,
-            'continuous':self.next_single,
+            'continuous':self.next_continuous,
                 }[mode]
 
         self.has_next = {
             '3D':self.has_next_3D,
+            'radial':self.has_next_3D,
+            'spiral':self.has_next_3D,
+            'crosshair':self.has_next_3D,
             'single' : lambda : True ,
             'continuous' : lambda : True,
                 }[mode]
 
         self.next_return = {
             '3D':self.next_return_3D,
+            'radial':self.next_return_3D,
+            'spiral':self.next_return_3D,
+            'crosshair':self.next_return_3D,
             'single':lambda : self.return_positions,
             'continuous':lambda : self.return_positions,
                 }[mode]
 
         self.scan_path = {
             '3D':self.make_scan_3D_path,
+            'radial':self.make_radial_path,
+            'spiral':self.make_spiral_path,
+            'crosshair':self.make_crosshair_path,
             'single':self.make_line_path,
             'continuous':self.make_line_path,
                 }[mode]()
 
         self.return_positions = {
-            '3D':self.make_return_3D_positions,
+            '3D':lambda : None,
+            'radial':lambda : None,
+            'spiral':lambda : None,
+            'crosshair':lambda : None,
             'single':self.make_single_smooth_return,
-            'continuous':self.make_single_smooth_return,
+            'continuous':self.make_continuous_return,
                 }[mode]()
 
 
+    def seek(self,i):
+        """Continues a 3D scan at tomogram i."""
+        self.i = i
+
     def has_next_3D(self):
         return self.i<self.numTomograms
 
@@ -147,34 +522,109 @@ class Path:
         self.has_next = lambda: False
         return self.scan_path
 
+    def next_continuous(self):
+        self.i += 1
+        if self.bidirectional and self.i%2 == 0:
+            return np.ascontiguousarray(self.scan_path[::-1])
+        return self.scan_path
+
+
     def next_3D(self):
         self.i += 1
         return self.scan_path[self.i-1]
 
     def next_return_3D(self):
-        return self.return_positions[self.i-1]
+        """Move to the start of the next line, or to the park position
+        after the last."""
+        return self.make_step(self.i - 1)
+
+    def make_step(self,i):
+        """Galvo move from the end of line i to the start of the next
+        one, or to the park position after the last."""
+        if i + 1 < self.numTomograms:
+            following = self.scan_path.start(i + 1)
+        else:
+            following = np.zeros(2)
+        return make_return(self.scan_path[i][-1],following,self.config,
+            self.mode)
+
+    def flyback_parts(self,i,k):
+        return flyback_parts(self.scan_path[i],self.scan_path[k],
+            galvo_limits(self.config),self.config['laser']['frequency'])
 
     def make_scan_3D_path(self):
-        x0,y0 = self.x0,self.y0
-        xf,yf = self.xf,self.yf
-        numTomograms = self.numTomograms
-        numRecords = self.numRecords
-        path = make_scan_3D_path(x0,y0,xf,y0,numTomograms,numRecords)
-        #this takes care of the memory arrangement
-        return np.ascontiguousarray(path)
+        return Lines(self.x0,self.y0,self.xf,self.yf,
+            self.numTomograms,self.numRecords,self.bidirectional)
+
+    def make_radial_path(self):
+        return Radial(self.x0,self.y0,self.xf,self.yf,
+            self.numTomograms,self.numRecords)
+
+    def make_spiral_path(self):
+        return Spiral(self.x0,self.y0,self.xf,self.yf,
+            self.numTomograms,self.numRecords,self.turns)
+
+    def make_crosshair_path(self):
+        return Crosshair(self.x0,self.y0,self.xf,self.yf,
+            self.numTomograms,self.numRecords)
+
+    def make_volume_path(self):
+        """Whole scan trajectory, the flyback after each line taking
+        self.flyback points, or with the jerk limited galvo profile the
+        fewest the limits allow, see flyback_length. The patterns other
+        than the 3D raster repeat, so their last line flies back to the
+        first."""
+        limits = galvo_limits(self.config)
+        if limits is not None:
+            return join_lines_limited(self.scan_path,limits,
+                self.config['laser']['frequency'],self.mode != '3D')[0]
+        if self.mode == '3D':
+            return make_volume_path(self.x0,self.y0,self.xf,self.yf,
+                self.numTomograms,self.numRecords,self.flyback,
+                self.bidirectional)
+        return join_lines(list(self.scan_path),self.flyback,closed=True)
 
     def make_single_smooth_return(self):
         pf = np.array([self.x0,self.y0])
         p0 = np.array([self.xf,self.yf])
-        acc = self.acc
-        return smooth_return(p0,pf,acc)
-    
-    def make_return_3D_positions(self):
-        positions = self.scan_path[:,0]
-        positions[0,:] = [0,0]
-        np.roll(positions,-1)
-        return positions
+        return make_return(p0,pf,self.config,self.mode)
+
+    def make_continuous_return(self):
+        """Return to the start of the line, None when the next sweep
+        starts where this one ended."""
+        if self.bidirectional:
+            return None
+        return self.make_single_smooth_return()
 
+    def flyback_length(self):
+        """Records of the jerk limited flybacks of the volume trajectory,
+        None with the constant acceleration profile. Only one flyback of
+        each of the pattern's moves is computed."""
+        if galvo_limits(self.config) is None:
+            return None
+        moves = self.scan_path.moves(self.mode != '3D')
+        return max(sum(len(part) for part in self.flyback_parts(i,k))
+            for i, k, n in moves)
+
+    def duty_cycle(self,line_rate,positioning_rate):
+        """Fraction of the scan time spent on the lines, the lines taking
+        a record at line_rate and the returns and steps between lines a
+        point at positioning_rate. Volume scans take the flyback of the
+        mode, as adjust_scope_config_to_scan sets it."""
+        line = self.numRecords/float(line_rate)
+        if self.volume:
+            dead = self.flyback/float(line_rate)
+        elif self.mode in ('single','continuous'):
+            dead = 0.
+            if self.return_positions is not None:
+                dead = len(self.return_positions)/float(positioning_rate)
+        else:
+            # the last step, to the park position, stands for itself
+            moves = self.scan_path.moves(False)
+            steps = sum(n*len(self.make_step(i)) for i, k, n in moves)
+            dead = steps/float(self.numTomograms*positioning_rate)
+        return line/(line + dead)
+    
     def make_line_path(self):
         x0,y0 = self.x0,self.y0
         xf,yf = self.xf,self.yf
@@ -0,0 +1,132 @@
+import logging
+import ctypes
+import Queue
+import numpy as np
+from time import time
+from multiprocessing import Process, RawArray
+from multiprocessing import Queue as ProcessQueue
+import bscan
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks that the workers are alive while waiting.
+POLL = 0.5
+
+def shared_array(shape, dtype):
+    dtype = np.dtype(dtype)
+    raw = RawArray(ctypes.c_char, int(np.prod(shape))*dtype.itemsize)
+    return np.frombuffer(raw, dtype).reshape(shape)
+
+def work(number, config, inputs, backgrounds, outputs, tasks, done):
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        sequence, slot, parameters, subtract = task
+        start = time()
+        kernel = bscan.get_kernel(inputs[slot], config)
+        background = backgrounds[slot] if subtract else None
+        kernel(inputs[slot], parameters, outputs[slot], background)
+        done.put((sequence, slot, number, time() - start))
+
+class ProcessingPool:
+    """Processes raw frames with bscan kernels on several worker processes
+    and hands the images back in acquisition order.
+
+    Frames and images live in shared memory slots, only slot numbers go
+    through the queues. put blocks while every slot is in use.
+    """
+    def __init__(self, config, shape, dtype, workers=2, slots=None):
+        if slots is None:
+            slots = 2*workers
+        self.inputs = shared_array((slots,) + shape, dtype)
+        self.backgrounds = shared_array((slots,shape[-1]), np.float64)
+        self.outputs = shared_array((slots,) + bscan.image_shape(shape, config),
+                np.uint8)
+        self.free = range(slots)
+        self.tasks = ProcessQueue()
+        self.done = ProcessQueue()
+        self.finished = {}
+        self.submitted = 0
+        self.returned = 0
+        self.frames = [0]*workers
+        self.busy = [0.0]*workers
+        self.workers = [Process(target=work, args=(i, config, self.inputs,
+            self.backgrounds, self.outputs, self.tasks, self.done)) for i in range(workers)]
+        for worker in self.workers:
+            worker.daemon = True
+            worker.start()
+
+    def put(self, frame, parameters, background=None):
+        while not self.free:
+            self.collect(block=True)
+        slot = self.free.pop()
+        self.inputs[slot] = frame
+        if background is not None:
+            self.backgrounds[slot] = background
+        self.tasks.put((self.submitted, slot, dict(parameters),
+            background is not None))
+        self.submitted += 1
+
+    def check(self):
+        """Raises RuntimeError when a worker died, its frames are lost."""
+        for number, worker in enumerate(self.workers):
+            if not worker.is_alive():
+                raise RuntimeError("Processing worker %d exited with code %s."%(
+                    number, worker.exitcode))
+
+    def get(self, block):
+        """Next finished frame, waiting for one if block is set as long as
+        every worker is alive."""
+        if not block:
+            return self.done.get(False)
+        while True:
+            try:
+                return self.done.get(True, POLL)
+            except Queue.Empty:
+                self.check()
+
+    def collect(self, block=False):
+        """Moves the images finished by the workers into the reorder
+        buffer and frees their slots, waiting for one if block is set."""
+        while self.returned + len(self.finished) < self.submitted:
+            try:
+                sequence, slot, number, elapsed = self.get(block)
+            except Queue.Empty:
+                return
+            self.finished[sequence] = self.outputs[slot].copy()
+            self.free.append(slot)
+            self.frames[number] += 1
+            self.busy[number] += elapsed
+            block = False
+
+    def results(self, block=False):
+        """Yields the processed images in acquisition order, as far as they
+        are ready, or until all submitted frames are returned if block is
+        set."""
+        while self.returned < self.submitted:
+            self.collect()
+            while block and self.returned not in self.finished:
+                self.collect(block=True)
+            if self.returned not in self.finished:
+                return
+            image = self.finished.pop(self.returned)
+            self.returned += 1
+            yield image
+
+    def depth(self):
+        """Number of frames submitted and not yet returned."""
+        return self.submitted - self.returned
+
+    def stats(self):
+        """Queue depth and frames per second of processing per worker."""
+        throughput = [frames/busy if busy else 0.0
+                for frames, busy in zip(self.frames, self.busy)]
+        return {'depth':self.depth(), 'frames':list(self.frames),
+                'throughput':throughput}
+
+    def close(self):
+        for worker in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join()
@@ -6,8 +6,12 @@
 
 Pixel formats you a looking for this http://fourcc.org/
 '''
-import gobject
-gobject.threads_init()
+import sys
+try:
+    import gobject
+    gobject.threads_init()
+except ImportError:
+    sys.stderr.write("Cannot import gobject module\n")
 import logging
 import numpy as np
 import matplotlib.pyplot as plt
@@ -15,9 +19,9 @@ from configobj import ConfigObj
 from validate import Validator
 from acquirer import log_type,resample
 import argparse
-import sys
 import cPickle
-from scipy import interpolate
+from resampler import make_resampler
+import bscan
 
 
 logging.basicConfig()
@@ -30,36 +34,41 @@ def renormalize(data,parameters):
     data = data * parameters['contrast']
     return data
 
-def transform(rsp_data):
-    return np.abs(np.fft.fft(rsp_data))
+def transform(rsp_data,out=None,depth=None):
+    return bscan.transform(rsp_data, out, depth)
 
 def resample(raw_data,config,rsp_data=None,axis=0):
-    if rsp_data == None:
+    if rsp_data is None:
         n = 320
-        rsp_data = np.zeros((n,raw_data.shape[-1]))
     else:
         n = rsp_data.shape[axis]
-    p = [config['resample_poly_coef']['p%d'%i] for i in range(8)]
-    f = np.poly1d(p)
-    old_x = f(np.arange(raw_data.shape[axis]))
-    new_x = np.linspace(0,raw_data.shape[axis],n)
-    if len(raw_data.shape) == 1:
-        tck = interpolate.splrep(old_x,raw_data,s=0)
-        rsp_data = interpolate.splev(new_x,tck)
-    else:
-        for line in range(raw_data.shape[-1]):
-            tck = interpolate.splrep(old_x,raw_data[:,line])
-            rsp_data[:,line] = interpolate.splev(new_x,tck)
-    return rsp_data
+    resampler = make_resampler(config, raw_data.shape[axis], n)
+    return resampler(raw_data, rsp_data, axis)
 
-def process(data,parameters,config):
-    #data = resample(data.T, config, axis=0).T
-    data = transform(data)
-    #data = 10*np.log(data)
+def process_staged(data,parameters,config,background=None):
+    """Stage by stage version of process, kept as its reference."""
+    num_pts, name, db, depth = bscan.settings(config)
+    if background is not None:
+        data = data - background
+    if num_pts:
+        rsp_data = np.zeros((num_pts,data.shape[0]))
+        data = resample(data.T, config, rsp_data, axis=0).T
+    data = data*bscan.WINDOWS[name](data.shape[-1])
+    data = transform(data,depth=depth)
+    if db:
+        data = 20*np.log10(data)
     data = renormalize(data,parameters)
+    data = np.clip(data,0,255)
     data = np.ascontiguousarray(np.uint8(data))
     return data
 
+def process(data,parameters,config,out=None,background=None):
+    """Processes a raw frame, one spectrum per row, into an uint8 image.
+    Without out the image is the kernel's buffer, overwritten by the next
+    frame of the same shape."""
+    kernel = bscan.get_kernel(data, config)
+    return kernel(data, parameters, out, background)
+
 def parse_arguments():
     flags = ['daemon']
     parser = argparse.ArgumentParser()
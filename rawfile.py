@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+"""Raw tomogram container.
+
+A fixed size header holding the magic string, followed by the JSON encoded
+description of the acquisition (frame shape and dtype, scan mode and
+geometry, calibration coefficients, creation time), then fixed size
+frames. Each frame is the time stamp of its fetch followed by the samples
+of a (numPts, numRecords) Fortran ordered tomogram, so frame i starts at
+HEADER_SIZE + i*frame_size and the whole file can be memory mapped.
+
+An acquisition can keep an index of its complete frames in a file of its
+own, each entry appended only once the frame is flushed, so a crashed
+acquisition can be resumed after its last indexed frame.
+"""
+import os
+import json
+import cPickle
+import logging
+import threading
+import numpy as np
+from time import time
+
+logger = logging.getLogger(__name__)
+
+MAGIC = 'OCTRAW01'
+HEADER_SIZE = 4096
+
+INDEX = np.dtype([
+    ('tomogram', '<i8'),
+    ('timestamp', '<f8'),
+    ])
+
+def frame_dtype(shape, dtype):
+    numPts, numRecords = shape
+    return np.dtype([
+        ('timestamp', '<f8'),
+        ('data', np.dtype(dtype), (numRecords, numPts)),
+        ])
+
+def sample_scale(voltage_range, bits):
+    """Volts per code of a bits bits converter spanning voltage_range."""
+    return float(voltage_range)/2**bits
+
+def describe(config, mode, shape, dtype=np.int16):
+    """Header metadata of an acquisition in the given mode. Integer
+    samples are the digitizer's binary codes, scale*sample + offset in
+    volts as its fetches report them, floating point samples are volts."""
+    vertical = config['scope']['VerticalSample']
+    bits = int(config['scope']['bits'])
+    scale, offset = 1.0, 0.0
+    if np.dtype(dtype).kind in 'iu':
+        scale = sample_scale(vertical['voltageRange'], bits)
+        offset = float(vertical['offset'])
+    return {
+        'shape': list(shape),
+        'dtype': np.dtype(dtype).str,
+        'voltage_range': float(vertical['voltageRange']),
+        'bits': bits,
+        'scale': scale,
+        'offset': offset,
+        'mode': mode,
+        'geometry': dict(config[mode]),
+        'path_to_voltage': dict(config['path_to_voltage']),
+        'calibration': dict(config['resample_poly_coef']),
+        'created': time(),
+        }
+
+def write_header(fd, metadata):
+    header = MAGIC + json.dumps(metadata)
+    if len(header) > HEADER_SIZE:
+        raise ValueError("Raw file header is larger than %d bytes."%HEADER_SIZE)
+    fd.write(header.ljust(HEADER_SIZE, '\0'))
+
+def read_header(filename):
+    with open(filename, 'rb') as fd:
+        header = fd.read(HEADER_SIZE)
+    if not header.startswith(MAGIC):
+        raise IOError("%s is not a raw tomogram file."%filename)
+    return json.loads(header[len(MAGIC):].rstrip('\0'))
+
+def index_filename(filename):
+    return filename + '.idx'
+
+def read_index(filename):
+    """Index entries of the complete frames of a raw file, None when it
+    has no index."""
+    try:
+        fd = open(index_filename(filename), 'rb')
+    except IOError:
+        return None
+    with fd:
+        fd.seek(0, 2)
+        count = fd.tell()//INDEX.itemsize
+        fd.seek(0)
+        return np.fromfile(fd, INDEX, count)
+
+def frame_count(filename):
+    """Number of complete frames in a raw file."""
+    metadata = read_header(filename)
+    dtype = frame_dtype(metadata['shape'], metadata['dtype'])
+    return (os.path.getsize(filename) - HEADER_SIZE)//dtype.itemsize
+
+def resume(filename):
+    """Truncates an interrupted raw file and its index after the last
+    frame both hold, and returns the number of frames kept."""
+    metadata = read_header(filename)
+    dtype = frame_dtype(metadata['shape'], metadata['dtype'])
+    count = frame_count(filename)
+    index = read_index(filename)
+    if index is not None:
+        count = min(count, len(index))
+        with open(index_filename(filename), 'r+b') as fd:
+            fd.truncate(count*INDEX.itemsize)
+    with open(filename, 'r+b') as fd:
+        fd.truncate(HEADER_SIZE + count*dtype.itemsize)
+    return count
+
+class Writer:
+    """Appends tomograms to a raw file, creating it unless append is set.
+    With index, every frame written is recorded in the index once flushed,
+    and with sync once it is on disk."""
+    def __init__(self, filename, metadata, append=False, index=False,
+            sync=False):
+        self.filename = filename
+        if append:
+            metadata = read_header(filename)
+            self.count = frame_count(filename)
+            self.fd = open(filename, 'ab')
+        else:
+            self.count = 0
+            self.fd = open(filename, 'wb')
+            write_header(self.fd, metadata)
+        self.index = None
+        if index:
+            self.index = open(index_filename(filename), 'ab' if append else 'wb')
+        self.durable = sync
+        self.metadata = metadata
+        self.dtype = frame_dtype(metadata['shape'], metadata['dtype'])
+
+    def write(self, tomogram, timestamp=None):
+        if timestamp is None:
+            timestamp = time()
+        np.float64(timestamp).tofile(self.fd)
+        np.asarray(tomogram, self.dtype['data'].base).T.tofile(self.fd)
+        self.count += 1
+        self.record([timestamp])
+
+    def write_frames(self, frames):
+        """Writes an array of frame_dtype frames at once."""
+        frames.tofile(self.fd)
+        self.count += len(frames)
+        self.record(frames['timestamp'])
+
+    def record(self, timestamps):
+        """Indexes the frames just written, after they reached the file."""
+        if self.index is None and not self.durable:
+            return
+        if self.durable:
+            self.sync()
+        else:
+            self.fd.flush()
+        if self.index is None:
+            return
+        entries = np.zeros(len(timestamps), INDEX)
+        entries['tomogram'] = np.arange(self.count - len(timestamps), self.count)
+        entries['timestamp'] = timestamps
+        entries.tofile(self.index)
+        self.index.flush()
+        if self.durable:
+            os.fsync(self.index.fileno())
+
+    def __len__(self):
+        return self.count
+
+    def flush(self):
+        self.fd.flush()
+
+    def sync(self):
+        self.fd.flush()
+        os.fsync(self.fd.fileno())
+
+    def close(self):
+        self.fd.close()
+        if self.index is not None:
+            self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class AsyncWriter(threading.Thread):
+    """Appends tomograms to a raw file from a thread of its own. put copies
+    each tomogram in one of `queue` frame slots and only blocks when they
+    are all waiting to be written. The thread writes up to `batch`
+    consecutive slots in one sequential write. The file is synced after
+    every write with fsync 'batch', when closed with 'close', or left to
+    the system with 'never'. With index, every batch is recorded in the
+    index of the file once written.
+    """
+    def __init__(self, filename, metadata, queue=16, batch=4, fsync='close',
+            append=False, index=False):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.writer = Writer(filename, metadata, append, index,
+                sync=fsync == 'batch')
+        self.filename = filename
+        self.metadata = self.writer.metadata
+        self.frames = np.zeros(queue, self.writer.dtype)
+        self.batch = batch
+        self.fsync = fsync
+        self.condition = threading.Condition()
+        self.head = 0
+        self.tail = 0
+        self.closed = False
+        self.error = None
+        self.high_water = 0
+        self.busy = 0.0
+        self.start()
+
+    def put(self, tomogram, timestamp=None):
+        if timestamp is None:
+            timestamp = time()
+        with self.condition:
+            while self.head - self.tail == len(self.frames) and self.error is None:
+                self.condition.wait()
+            if self.error is not None:
+                raise IOError("Writing %s failed: %s"%(self.filename, self.error))
+        slot = self.head%len(self.frames)
+        self.frames['timestamp'][slot] = timestamp
+        self.frames['data'][slot] = tomogram.T
+        with self.condition:
+            self.head += 1
+            self.high_water = max(self.high_water, self.head - self.tail)
+            self.condition.notify()
+
+    def write(self, tomogram, timestamp=None):
+        self.put(tomogram, timestamp)
+
+    def __len__(self):
+        return self.tail
+
+    def close(self):
+        """Writes the frames still queued and closes the file."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.join()
+
+    def stats(self):
+        """Frames written, write bandwidth in MB/s and the most frames that
+        waited in the queue."""
+        written = self.tail*self.frames.itemsize
+        bandwidth = written/self.busy/2**20 if self.busy else 0.0
+        return {'frames':self.tail, 'bandwidth':bandwidth,
+                'high_water':self.high_water, 'queue':len(self.frames)}
+
+    def run(self):
+        try:
+            while True:
+                with self.condition:
+                    while self.head == self.tail and not self.closed:
+                        self.condition.wait()
+                    if self.head == self.tail:
+                        break
+                    start = self.tail%len(self.frames)
+                    count = min(self.head - self.tail, self.batch,
+                            len(self.frames) - start)
+                began = time()
+                self.writer.write_frames(self.frames[start:start + count])
+                self.busy += time() - began
+                with self.condition:
+                    self.tail += count
+                    self.condition.notify()
+            if self.fsync == 'close':
+                self.writer.sync()
+        except Exception, e:
+            logger.exception(e)
+            with self.condition:
+                self.error = e
+                self.condition.notify()
+        finally:
+            self.writer.close()
+
+def load(filename, mode='r'):
+    """Header metadata and the memory mapped frames of a raw file. Frames
+    past the last complete one, left by an interrupted write, are
+    ignored."""
+    metadata = read_header(filename)
+    dtype = frame_dtype(metadata['shape'], metadata['dtype'])
+    with open(filename, 'rb') as fd:
+        fd.seek(0, 2)
+        count = (fd.tell() - HEADER_SIZE)//dtype.itemsize
+    if count == 0:
+        return metadata, np.zeros(0, dtype)
+    frames = np.memmap(filename, dtype, mode, offset=HEADER_SIZE, shape=(count,))
+    return metadata, frames
+
+def tomogram(frames, i):
+    """Tomogram i of memory mapped frames, as a (numPts, numRecords)
+    Fortran ordered view."""
+    return frames['data'][i].T
+
+class Volume:
+    """A raw file seen as an array of (numTomograms, numPts, numRecords)
+    samples. Opening it only reads the header, every slice is a view of
+    the memory mapped file, so only the pages actually used are read."""
+    def __init__(self, filename):
+        self.filename = filename
+        self.metadata, frames = load(filename)
+        self.index = read_index(filename)
+        self.timestamps = frames['timestamp']
+        self.data = frames['data'].transpose(0, 2, 1)
+        self.shape = self.data.shape
+        self.dtype = self.data.dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        return self.data[index]
+
+    def tomogram(self, i):
+        """(numPts, numRecords) samples of tomogram i."""
+        return self.data[i]
+
+    def volts(self, i):
+        """Tomogram i converted to volts."""
+        return self.metadata.get('scale', 1.0)*self.data[i] + \
+                self.metadata.get('offset', 0.0)
+
+    def record(self, j):
+        """(numTomograms, numPts) spectra of record j of every tomogram."""
+        return self.data[:,:,j]
+
+    def depth(self, k):
+        """(numTomograms, numRecords) samples at index k of every record."""
+        return self.data[:,k,:]
+
+def convert(pickle_filename, filename, metadata):
+    """Converts a raw data file made of pickled tomograms."""
+    with open(pickle_filename, 'rb') as fd:
+        unpickler = cPickle.Unpickler(fd)
+        writer = None
+        while True:
+            try:
+                data = unpickler.load()
+            except EOFError:
+                break
+            if writer is None:
+                metadata = dict(metadata, shape=list(data.shape),
+                        dtype=data.dtype.str)
+                if data.dtype.kind == 'f':
+                    metadata.update(scale=1.0, offset=0.0)
+                writer = Writer(filename, metadata)
+            writer.write(data, 0.0)
+    if writer is not None:
+        writer.close()
+
+def parse():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.description = "Converts pickled raw data to a raw tomogram file."
+    parser.add_argument('-i', dest='in_file', default='raw_data')
+    parser.add_argument('-o', dest='out_file', default='raw_data.raw')
+    parser.add_argument('--mode', dest='mode', default='single')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    from configobj import ConfigObj
+    arg = parse()
+    config = ConfigObj('config.ini')
+    metadata = describe(config, arg.mode, (0,0))
+    convert(arg.in_file, arg.out_file, metadata)
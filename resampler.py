@@ -0,0 +1,108 @@
+import numpy as np
+from scipy import sparse
+from collections import OrderedDict
+
+# Largest deviation from the scipy.interpolate.splrep/splev resampling it
+# replaces, relative to the signal amplitude, for fringes sampled with at
+# least 8 points per period (see test_resampler.py).
+TOLERANCE = {
+    'linear': 8e-2,
+    'cubic': 1e-2,
+    }
+
+# Number of resampling plans kept, the least recently used is dropped first.
+PLAN_CACHE_SIZE = 8
+plans = OrderedDict()
+
+def calibration(config):
+    """Coefficients of the polynomial mapping sample index to k-space."""
+    return tuple(config['resample_poly_coef']['p%d'%i] for i in range(8))
+
+def sample_positions(coefficients, num_in, num_out):
+    """Uneven k-space positions of the acquired samples and the even grid
+    they are resampled onto."""
+    f = np.poly1d(coefficients)
+    old_x = f(np.arange(num_in))
+    new_x = np.linspace(0, num_in, num_out)
+    return old_x, new_x
+
+def stencil(old_x, new_x, width):
+    """Index of the first of `width` consecutive samples surrounding each
+    point of new_x. Points outside old_x use the stencil at the border."""
+    left = np.searchsorted(old_x, new_x) - width//2
+    return np.clip(left, 0, len(old_x) - width)
+
+def linear_weights(old_x, new_x):
+    first = stencil(old_x, new_x, 2)
+    indices = first[:,np.newaxis] + np.arange(2)
+    x0, x1 = old_x[indices].T
+    t = (new_x - x0)/(x1 - x0)
+    weights = np.vstack((1 - t, t)).T
+    return indices, weights
+
+def cubic_weights(old_x, new_x):
+    """Lagrange weights of the cubic through the four nearest samples."""
+    first = stencil(old_x, new_x, 4)
+    indices = first[:,np.newaxis] + np.arange(4)
+    x = old_x[indices]
+    weights = np.ones(indices.shape)
+    for k in range(4):
+        for m in range(4):
+            if m != k:
+                weights[:,k] *= (new_x - x[:,m])/(x[:,k] - x[:,m])
+    return indices, weights
+
+KERNELS = {
+    'linear': linear_weights,
+    'cubic': cubic_weights,
+    }
+
+def make_operator(indices, weights, num_in):
+    """Banded sparse matrix taking num_in samples to len(indices) samples."""
+    num_out, width = indices.shape
+    indptr = np.arange(0, num_out*width + 1, width)
+    return sparse.csr_matrix((weights.ravel(), indices.ravel(), indptr),
+            shape=(num_out, num_in))
+
+class Resampler:
+    """Resamples spectra from the uneven k-space sampling of the laser
+    sweep onto an even grid. The interpolation operator is built once and
+    applied to a single A-line, a B-scan or a stack of B-scans in one call.
+    """
+    def __init__(self, old_x, new_x, kind='cubic'):
+        self.old_x = old_x
+        self.new_x = new_x
+        self.kind = kind
+        self.indices, self.weights = KERNELS[kind](old_x, new_x)
+        self.operator = make_operator(self.indices, self.weights, len(old_x))
+
+    def __call__(self, raw_data, rsp_data=None, axis=0):
+        raw_data = np.moveaxis(np.asarray(raw_data), axis, 0)
+        lines = raw_data.shape[1:]
+        data = self.operator.dot(raw_data.reshape((raw_data.shape[0], -1)))
+        data = np.moveaxis(data.reshape(data.shape[:1] + lines), 0, axis)
+        if rsp_data is None:
+            return data
+        rsp_data[...] = data
+        return rsp_data
+
+def make_resampler(config, num_in, num_out, kind=None):
+    """Resampler for the current calibration, reused across frames as long
+    as the coefficients and frame shape do not change."""
+    if kind is None:
+        kind = config.get('resample_kind', 'cubic')
+    key = (calibration(config), num_in, num_out, kind)
+    try:
+        plan = plans.pop(key)
+    except KeyError:
+        old_x, new_x = sample_positions(key[0], num_in, num_out)
+        plan = Resampler(old_x, new_x, kind)
+        if len(plans) >= PLAN_CACHE_SIZE:
+            plans.popitem(last=False)
+    plans[key] = plan
+    return plan
+
+def invalidate():
+    """Drops every cached plan, to be called when the calibration is
+    rewritten."""
+    plans.clear()
@@ -0,0 +1,134 @@
+import os
+import numpy as np
+from time import time
+
+MAGIC = 'OCTRING2'
+
+# written is updated while readers look at it, it has to be 8 byte aligned
+# to be read and written whole.
+HEADER = np.dtype([
+    ('magic', 'S8'),
+    ('slots', '<u4'),
+    ('numPts', '<u4'),
+    ('numRecords', '<u4'),
+    ('padding', '<u4'),
+    ('dtype', 'S8'),
+    ('written', '<i8'),
+    ])
+
+SLOT_HEADER = np.dtype([
+    ('sequence', '<i8'),
+    ('timestamp', '<f8'),
+    ])
+
+class Overrun(Exception):
+    pass
+
+class Ring:
+    """Fixed number of frame slots in a memory mapped file, written by the
+    acquisition and read by any number of viewers in other processes.
+
+    A background spectrum estimated by the acquisition is kept alongside
+    the frames. Each slot has a small header with the sequence number and
+    time stamp of the frame it holds. The sequence is cleared while the
+    slot is being written, so a reader can tell a frame was overwritten
+    under it. Frames are (numPts, numRecords) Fortran ordered, like the
+    scope buffers.
+    """
+    def __init__(self, filename, slots=None, shape=None, dtype=np.int32):
+        self.filename = filename
+        if slots is not None:
+            self.create(slots, shape, dtype)
+        self.map()
+        self.next = 0
+        self.dropped = 0
+
+    def create(self, slots, shape, dtype):
+        header = np.zeros((), HEADER)
+        header['magic'] = MAGIC
+        header['slots'] = slots
+        header['numPts'], header['numRecords'] = shape
+        header['dtype'] = np.dtype(dtype).str
+        # write to a new file so readers of a previous ring are not confused
+        temporary = self.filename + '.new'
+        with open(temporary, 'wb') as fd:
+            fd.write(header.tobytes())
+            fd.write(np.zeros(shape[0]).tobytes())
+            slot_headers = np.zeros(slots, SLOT_HEADER)
+            slot_headers['sequence'] = -1
+            fd.write(slot_headers.tobytes())
+            fd.truncate(self.size(slots, shape, dtype))
+        os.rename(temporary, self.filename)
+
+    def size(self, slots, shape, dtype):
+        frame = np.dtype(dtype).itemsize*shape[0]*shape[1]
+        background = 8*shape[0]
+        return HEADER.itemsize + background + slots*(SLOT_HEADER.itemsize + frame)
+
+    def map(self):
+        self.inode = os.stat(self.filename).st_ino
+        self.header = np.memmap(self.filename, HEADER, 'r+', shape=())
+        if self.header['magic'].item() != MAGIC:
+            raise IOError("%s is not a frame ring."%self.filename)
+        slots = int(self.header['slots'])
+        self.shape = (int(self.header['numPts']), int(self.header['numRecords']))
+        self.dtype = np.dtype(self.header['dtype'].item())
+        offset = HEADER.itemsize
+        self.background = np.memmap(self.filename, '<f8', 'r+', offset=offset,
+                shape=(self.shape[0],))
+        offset += self.background.nbytes
+        self.slots = np.memmap(self.filename, SLOT_HEADER, 'r+',
+                offset=offset, shape=(slots,))
+        offset += self.slots.nbytes
+        frames = np.memmap(self.filename, self.dtype, 'r+', offset=offset,
+                shape=(slots,self.shape[1],self.shape[0]))
+        self.frames = frames.transpose(0, 2, 1)
+
+    def replaced(self):
+        """True when the acquisition created a new ring since this one was
+        opened."""
+        try:
+            return os.stat(self.filename).st_ino != self.inode
+        except OSError:
+            return False
+
+    def written(self):
+        return int(self.header['written'])
+
+    def write(self, frame):
+        sequence = self.written()
+        slot = sequence%len(self.slots)
+        self.slots['sequence'][slot] = -1
+        self.frames[slot] = frame
+        self.slots['timestamp'][slot] = time()
+        self.slots['sequence'][slot] = sequence
+        self.header['written'] = sequence + 1
+        return sequence
+
+    def read(self, out=None, latest=False):
+        """Next frame as (sequence, timestamp, frame), or None when no new
+        frame was written. Frames overwritten before they could be read are
+        skipped and counted in self.dropped; with latest only the newest
+        frame is returned."""
+        written = self.written()
+        if self.next >= written:
+            return None
+        oldest = written - (1 if latest else len(self.slots))
+        if self.next < oldest:
+            self.dropped += oldest - self.next
+            self.next = oldest
+        sequence = self.next
+        slot = sequence%len(self.slots)
+        if out is None:
+            out = np.zeros(self.shape, self.dtype, order='F')
+        self.next += 1
+        self.check(slot, sequence)
+        timestamp = self.slots['timestamp'][slot]
+        out[:] = self.frames[slot]
+        self.check(slot, sequence)
+        return sequence, timestamp, out
+
+    def check(self, slot, sequence):
+        if self.slots['sequence'][slot] != sequence:
+            self.dropped += 1
+            raise Overrun("Frame %d was overwritten while read."%sequence)
@@ -48,7 +48,7 @@ VerticalSample = {
 
 def allocate_memory():
     X = Horizontal['numPts']
-    return np.zeros([X ,1],order='F',dtype=np.int32)
+    return np.zeros([X ,1],order='F',dtype=np.int16)
 
 def initialize_scope():
     scope = niScope.Scope(dev)
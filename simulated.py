@@ -0,0 +1,140 @@
+"""Hardware free stand-ins for the digitizer and the galvo output task.
+
+Scope follows the part of niScope.Scope used by the acquisition and fills
+the caller's buffers with synthetic interferograms, like
+image_generator.matrix, no faster than the trigger rate allows.
+AnalogOutputTask follows nidaqmx.AnalogOutputTask and plays its waveforms
+in real time on the onboard clock.
+"""
+import numpy as np
+from time import time, sleep
+
+def spectrum(num_pts, lengths, visibility=0.5):
+    """(num_pts, len(lengths)) interferograms of reflectors at the given
+    path length differences, in micrometers, on a gaussian source."""
+    lmbd = np.linspace(1.25, 1.35, num_pts)[:,None]
+    envelope = np.exp(-((lmbd - 1.3)/0.02)**2)
+    return envelope*(1 + visibility*np.cos(2*np.pi*lengths/lmbd))
+
+def matrix(num_pts, num_records, phase):
+    lengths = 500*np.sin(phase + 4*np.linspace(0, 2, num_records)) + 1000
+    return spectrum(num_pts, lengths)
+
+class Scope:
+    """Simulated digitizer. Records come at trigger_rate per second after
+    InitiateAcquisition, Fetch waits for the last one. The tomograms
+    cycle through `frames` precomputed ones with moving reflectors.
+    Integer buffers receive the codes of a converter of the given bits
+    spanning voltage_range, like the binary fetches of the digitizer:
+    voltage_range/2**bits*code + offset in volts. The frames are made
+    ahead for buffers of dtype, the others get theirs on the first fetch.
+    """
+    def __init__(self, resourceName='Sim', trigger_rate=16000.0, frames=8,
+            noise=0.01, seed=0, dtype=np.int16, bits=14, voltage_range=2.0,
+            offset=0.0):
+        self.resourceName = resourceName
+        self.trigger_rate = trigger_rate
+        self.dtype = dtype
+        self.bits = bits
+        self.voltage_range = voltage_range
+        self.offset = offset
+        self.noise = noise
+        self.count = frames
+        self.random = np.random.RandomState(seed)
+        self.numPts = 1
+        self.numRecords = 1
+        self.started = None
+        self.fetched = 0
+        self.frames = {}
+
+    def ConfigureHorizontalTiming(self, numPts=1, numRecords=1, **timing):
+        self.numPts = numPts
+        self.numRecords = numRecords
+        # built now rather than in the first, timed, fetch
+        self.make_frames((numPts, numRecords), self.dtype)
+
+    def ConfigureVertical(self, **vertical):
+        pass
+
+    def ConfigureTrigger(self, **trigger):
+        pass
+
+    def ConfigureChanCharacteristics(self, **characteristics):
+        pass
+
+    def ExportSignal(self, **signal):
+        pass
+
+    def InitiateAcquisition(self):
+        self.started = time()
+
+    def make_frames(self, shape, dtype):
+        key = (shape, np.dtype(dtype).str)
+        if key not in self.frames:
+            integer = np.dtype(dtype).kind in 'iu'
+            frames = []
+            for i in range(self.count):
+                frame = matrix(shape[0], shape[1], 0.1*i)
+                frame += self.random.normal(0, self.noise, shape)
+                if integer:
+                    frame = np.round((frame - self.offset)*2**self.bits/
+                            self.voltage_range)
+                frames.append(np.asarray(frame, dtype, order='F'))
+            self.frames[key] = frames
+        return self.frames[key]
+
+    def Fetch(self, channelList, data, timeout=None):
+        if self.started is None:
+            raise RuntimeError("Fetch without InitiateAcquisition.")
+        remaining = self.started + self.numRecords/self.trigger_rate - time()
+        if remaining > 0:
+            sleep(remaining)
+        frames = self.make_frames(data.shape, data.dtype)
+        data[:] = frames[self.fetched%len(frames)]
+        self.fetched += 1
+        self.started = None
+        return data
+
+class AnalogOutputTask:
+    """Simulated analog output task. Waveforms on an external clock are
+    taken as played at once, on the onboard clock they take
+    samples/rate seconds from the write."""
+    def __init__(self, name=''):
+        self.name = name
+        self.channels = []
+        self.timing = {}
+        self.signal = None
+        self.finish = 0.0
+
+    def create_voltage_channel(self, phys_channel, channel_name='', **limits):
+        self.channels.append(phys_channel)
+
+    def configure_timing_sample_clock(self, **timing):
+        self.timing = timing
+
+    def write(self, data, auto_start=True, **options):
+        data = np.asarray(data, np.float64)
+        if data.ndim > 1 and data.shape[-1] != len(self.channels):
+            raise ValueError("%d channels written to a task of %d."%(
+                data.shape[-1], len(self.channels)))
+        self.signal = data
+        if auto_start:
+            self.start()
+        return len(data)
+
+    def start(self):
+        duration = 0.0
+        if self.timing.get('source') == 'OnboardClock':
+            duration = len(self.signal)/float(self.timing['rate'])
+        self.finish = time() + duration
+
+    def stop(self):
+        self.finish = 0.0
+
+    def wait_until_done(self, timeout=-1):
+        remaining = self.finish - time()
+        if remaining > 0:
+            sleep(remaining)
+
+    def clear(self):
+        self.channels = []
@@ -0,0 +1,12 @@
+import numpy as np
+import background
+
+def test_mean_and_ewma_updates():
+	tomograms = [np.asfortranarray(np.ones((32,8), dtype=np.int32)*i) for i in range(1,5)]
+	mean = background.Background(32, 'mean')
+	ewma = background.Background(32, 'ewma', 0.5)
+	for tomogram in tomograms:
+		mean.update(tomogram)
+		ewma.update(tomogram)
+	assert np.allclose(mean.spectrum, 2.5)
+	assert np.allclose(ewma.spectrum, ((1*0.5 + 2*0.5)*0.5 + 3*0.5)*0.5 + 4*0.5)
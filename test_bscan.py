@@ -0,0 +1,53 @@
+import numpy as np
+from scipy import fftpack
+import bscan
+
+def test_transform_keeps_non_redundant_half():
+	rsp_data = np.random.rand(4,320)
+	expected = np.abs(np.fft.fft(rsp_data))[:,:160]
+	assert np.allclose(bscan.transform(rsp_data), expected)
+	assert np.allclose(bscan.transform(rsp_data.T, axis=0), expected.T)
+
+def test_transform_writes_depth_window_into_buffer():
+	rsp_data = np.random.rand(1024,8)
+	out = bscan.allocate_transform(rsp_data.shape, (20,300), axis=0)
+	assert out.shape == (280,8)
+	result = bscan.transform(rsp_data, out, (20,300), axis=0)
+	assert result is out
+	assert np.allclose(out, np.abs(np.fft.fft(rsp_data, axis=0))[20:300])
+
+def test_kernel_transform_is_done_in_place():
+	for num_pts in [320, 1024, 2420]:
+		kernel = bscan.Kernel((4,num_pts), {'processing':{}})
+		assert fftpack.rfft(kernel.rsp, overwrite_x=True) is kernel.rsp
+
+def test_kernel_uses_the_returned_transform(monkeypatch):
+	rfft = fftpack.rfft
+	monkeypatch.setattr(bscan.fftpack, 'rfft',
+			lambda x, overwrite_x=False: rfft(x.copy()))
+	data = np.random.rand(4,320)
+	kernel = bscan.Kernel(data.shape, {'processing':{}})
+	image = kernel(data, {'brightness':0.0, 'contrast':1.0})
+	expected = np.abs(np.fft.rfft(data.astype(np.float32)))[:,:160]
+	assert np.array_equal(image, np.clip(expected, 0, 255).astype(np.uint8))
+
+def test_kernels_follow_the_resampling_kind():
+	data = np.zeros((4,320))
+	coefficients = dict(('p%d'%i, 0.0) for i in range(8))
+	coefficients['p6'] = 1.0
+	config = {'processing':{'resample_pts':256},
+			'resample_poly_coef':coefficients, 'resample_kind':'linear'}
+	linear = bscan.get_kernel(data, config)
+	config['resample_kind'] = 'cubic'
+	cubic = bscan.get_kernel(data, config)
+	assert linear is not cubic
+	assert len(cubic.indices) > len(linear.indices)
+
+def test_background_is_removed_a_block_at_a_time():
+	data = np.random.rand(500,320)
+	background = np.random.rand(320)
+	kernel = bscan.Kernel(data.shape, {'processing':{'window':'hann'}})
+	assert len(kernel.blocks) > 1
+	kernel.resample(data, background)
+	expected = (data - background)*np.hanning(320)
+	assert np.allclose(kernel.rsp, expected, atol=1e-6)
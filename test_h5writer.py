@@ -0,0 +1,72 @@
+import numpy as np
+import h5py
+import h5writer
+
+def test_streams_images_into_one_dataset(tmpdir):
+	filename = str(tmpdir.join('tomograms.h5'))
+	images = np.random.randint(0, 255, (70,120,64)).astype(np.uint8)
+	config = {'log':10, 'processing':{'db':True, 'contrast':4.0}}
+	writer = h5writer.TomogramWriter(filename, (120,64), config=config,
+			compression='lzf')
+	for image in images:
+		writer.put(image)
+	writer.close()
+	with h5py.File(filename, 'r') as fd:
+		dataset = fd['tomograms']
+		assert np.array_equal(dataset[...], images)
+		assert dataset.chunks == h5writer.chunk_shape((120,64), np.uint8)
+		assert dataset.attrs['processing/contrast'] == 4.0
+		assert dataset.attrs['log'] == 10
+
+def test_en_face_planes_touch_few_chunks(tmpdir, monkeypatch):
+	monkeypatch.setattr(h5writer, 'CHUNK_SIZE', 2**14)
+	filename = str(tmpdir.join('tomograms.h5'))
+	images = np.random.randint(0, 255, (70,120,64)).astype(np.uint8)
+	writer = h5writer.TomogramWriter(filename, (120,64))
+	for image in images:
+		writer.put(image)
+	writer.close()
+	with h5py.File(filename, 'r') as fd:
+		dataset = fd['tomograms']
+		rows, lines, depths = dataset.chunks
+		assert lines == 120 and depths < 64
+		assert np.array_equal(dataset[:,:,10], images[:,:,10])
+	# the plane of one depth lies in one chunk of each rows tomograms
+	touched = -(-70//rows)*-(-120//lines)
+	chunks = touched*-(-64//depths)
+	assert touched == -(-70//rows) and touched < chunks/4
+	assert rows*lines*depths <= 2**14
+
+def test_appending_keeps_the_earlier_stream(tmpdir):
+	filename = str(tmpdir.join('tomograms.h5'))
+	first = np.ones((3,20,16), np.uint8)
+	second = 2*np.ones((2,10,16), np.uint8)
+	writer = h5writer.TomogramWriter(filename, (20,16))
+	for image in first:
+		writer.put(image)
+	writer.close()
+	writer = h5writer.TomogramWriter(filename, (10,16), mode='a')
+	for image in second:
+		writer.put(image)
+	writer.close()
+	assert writer.dataset == 'tomograms_1'
+	with h5py.File(filename, 'r') as fd:
+		assert np.array_equal(fd['tomograms'][...], first)
+		assert np.array_equal(fd['tomograms_1'][...], second)
+
+def test_writing_errors_are_raised_by_put(tmpdir):
+	filename = str(tmpdir.join('missing', 'tomograms.h5'))
+	writer = h5writer.TomogramWriter(filename, (20,16), queue_size=1)
+	try:
+		for i in range(10):
+			writer.put(np.zeros((20,16), np.uint8))
+	except IOError:
+		pass
+	else:
+		assert False
+	try:
+		writer.close()
+	except IOError:
+		pass
+	else:
+		assert False
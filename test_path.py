@@ -31,3 +31,189 @@ def test_smooth_return():
 	max_acc = np.max(np.diff(np.diff(p,axis=0),axis=0))
 	error = np.abs(max_acc - a)/a
 	assert error < 1, "max_acc is %s"%np.diff(np.diff(p,axis=0),axis=0)
+
+def test_volume_path_joins_lines_with_smooth_flybacks():
+	volume = path.make_volume_path(0., 0., 1., 1., 4, 101, 20)
+	assert volume.shape == (4*121, 2)
+	lines = volume.reshape(4, 121, 2)
+	assert np.allclose(lines[:,:101], path.make_scan_3D_path(0., 0., 1., 1., 4, 101))
+	steps = np.abs(np.diff(volume[:-20], axis=0))
+	assert steps[:,0].max() < 0.1
+	assert steps[:,1].max() < 0.05
+	assert np.allclose(lines[-1,101:,1], 1.)
+
+def test_3D_lines_are_computed_on_demand():
+	config = {"3D":{"x0":0., "y0":0., "xf":1., "yf":1.,
+			"numTomograms":10**7, "numRecords":1000, "acc":0.1}}
+	scan = Path(config, "3D")
+	line = scan.next()
+	assert line.shape == (1000,2) and line.flags.c_contiguous
+	step = scan.next_return()
+	assert np.allclose(step[[0,-1]], [[1., 0.], [0., 1e-7]])
+	scan.seek(10**7 - 1)
+	assert np.allclose(scan.next()[-1], [1., 1.])
+	assert np.allclose(scan.next_return()[-1], [0., 0.])
+	assert not scan.has_next()
+
+def test_3D_lines_match_the_scan_path():
+	lines = path.Lines(0., 0., 1., 2., 5, 64)
+	expected = path.make_scan_3D_path(0., 0., 1., 2., 5, 64)
+	assert len(lines) == 5
+	assert np.allclose(np.array(list(lines)), expected)
+	assert np.allclose(lines[-1], expected[-1])
+
+def test_radial_lines_cross_at_the_centre():
+	lines = path.Radial(0., 0., 2., 1., 4, 101)
+	assert len(lines) == 4
+	for line in lines:
+		assert np.allclose(line[50], [1., .5])
+		assert np.allclose(np.hypot(*(line[0] - line[-1])), 1.)
+	assert np.allclose(lines[2][0], [1., 0.])
+
+def test_spiral_starts_at_the_centre_with_even_spacing():
+	spiral = path.Spiral(-1., -1., 1., 1., 3, 2001, 2.)
+	assert np.allclose(spiral[1][0], [0., 0.])
+	assert np.allclose(np.hypot(*spiral[1][-1]), 1.)
+	steps = np.hypot(*np.diff(spiral[0], axis=0).T)
+	assert steps[200:].max() < 1.1*steps[200:].min()
+
+def test_crosshair_alternates_horizontal_and_vertical_lines():
+	config = {"crosshair":{"x0":0., "y0":0., "xf":1., "yf":2.,
+			"numTomograms":4, "numRecords":11, "acc":0.1, "flyback":8}}
+	scan = Path(config, "crosshair")
+	horizontal = scan.next()
+	assert np.allclose(horizontal[:,1], 1.) and horizontal[-1,0] == 1.
+	assert np.allclose(scan.next_return()[[0,-1]], [[1., 1.], [.5, 0.]])
+	vertical = scan.next()
+	assert np.allclose(vertical[:,0], .5) and vertical[-1,1] == 2.
+	trajectory = scan.make_volume_path()
+	assert trajectory.shape == (4*19, 2)
+	assert np.allclose(trajectory[-1], trajectory[0], atol=0.1)
+
+def test_bidirectional_lines_go_back_on_odd_lines():
+	lines = path.Lines(0., 0., 1., 1., 4, 11, bidirectional=True)
+	assert np.allclose(lines[0][:,0], np.linspace(0., 1., 11))
+	assert np.allclose(lines[1][:,0], np.linspace(1., 0., 11))
+	assert np.allclose(lines.start(3), lines[3][0])
+	volume = path.make_volume_path(0., 0., 1., 1., 4, 11, 5, True)
+	assert np.abs(np.diff(volume[:-5], axis=0)).max() < 0.5
+
+def test_bidirectional_continuous_scan_needs_no_return():
+	config = {"continuous":{"x0":0., "y0":0., "xf":1., "yf":0.,
+			"numRecords":11, "acc":0.1, "bidirectional":True}}
+	scan = Path(config, "continuous")
+	forth = scan.next()
+	assert scan.next_return() is None
+	back = scan.next()
+	assert np.allclose(back, forth[::-1]) and back.flags.c_contiguous
+	assert np.allclose(scan.next(), forth)
+
+def check_limits(p, rate, velocity, acceleration, jerk):
+	for order, limit in enumerate((velocity, acceleration, jerk)):
+		derivative = np.diff(p, order + 1, axis=0)*rate**(order + 1)
+		assert np.abs(derivative).max() <= limit*(1 + 1e-6)
+
+def test_jerk_limited_return_respects_the_galvo_limits():
+	rate = 10000.
+	p0, pf = np.array([1., .5]), np.array([0., 0.])
+	for velocity, acceleration, jerk in [(200., 2e5, 1e9), (5., 2e5, 1e9),
+			(200., 2e3, 1e5), (200., 2e5, 1e6)]:
+		p = path.jerk_limited_return(p0, pf, velocity, acceleration, jerk, rate)
+		assert np.allclose(p[0], p0) and np.all(p[-1] == pf)
+		check_limits(p, rate, velocity, acceleration, jerk)
+	p = path.jerk_limited_return(p0, pf, [200., 10.], 2e5, 1e9, rate)
+	assert np.abs(np.diff(p[:,1]))[:-1].max()*rate <= 10.*(1 + 1e-6)
+
+def test_jerk_limited_return_against_constant_acceleration():
+	rate = 10000.
+	acc = 1e-5
+	p0, pf = np.array([1., 1.]), np.array([0., 0.])
+	constant = path.smooth_return(p0, pf, np.array([acc, acc]))
+	# with the acceleration of the constant profile and a stiff jerk
+	p = path.jerk_limited_return(p0, pf, 1e3, acc*rate**2, 1e9, rate)
+	assert len(constant) - 2 <= len(p) <= 1.05*len(constant)
+	# the acceleration the galvos actually take is far larger
+	p = path.jerk_limited_return(p0, pf, 200., 2e5, 1e9, rate)
+	assert len(p) < len(constant)/5.
+
+def test_duty_cycle_of_a_line_scan():
+	config = {"single":{"x0":0., "y0":0., "xf":1., "yf":0.,
+			"numRecords":160, "acc":0.1},
+		"galvo":{"profile":"jerk_limited", "velocity":200.,
+			"acceleration":2e5, "jerk":1e9},
+		"daq":{"positioning":{"rate":10000}}}
+	scan = Path(config, "single")
+	duty = scan.duty_cycle(16000., 10000.)
+	line = 160/16000.
+	assert np.allclose(duty, line/(line + len(scan.return_positions)/10000.))
+	assert 0.5 < duty < 1
+
+def limited_config(mode, **geometry):
+	config = {mode:dict({"x0":0., "y0":0., "xf":1., "yf":1.,
+			"numTomograms":4, "numRecords":256, "acc":1e-5, "flyback":8,
+			"volume":True, "turns":1.}, **geometry),
+		"galvo":{"profile":"jerk_limited", "velocity":200.,
+			"acceleration":2e5, "jerk":1e9},
+		"laser":{"frequency":16000.},
+		"daq":{"positioning":{"rate":10000}}}
+	return config
+
+def test_volume_flybacks_respect_the_galvo_limits():
+	for mode, geometry in [('3D', {}), ('3D', {'bidirectional':True}),
+			('radial', {}), ('spiral', {}), ('crosshair', {})]:
+		scan = Path(limited_config(mode, **geometry), mode)
+		flyback = scan.flyback_length()
+		trajectory = scan.make_volume_path()
+		assert trajectory.shape == (4*(256 + flyback), 2)
+		lines = trajectory.reshape(4, -1, 2)
+		assert np.allclose(lines[:,:256], list(scan.scan_path))
+		for line, following in zip(lines, lines[1:]):
+			# the straight lines are left and joined at their speed
+			joined = line[253:] if mode == 'spiral' else \
+					np.concatenate((line[253:], following[:3]))
+			check_limits(joined, 16000., 200., 2e5, 1e9)
+		scan.flyback = flyback
+		assert 0.5 < scan.duty_cycle(16000., 10000.) < 1
+	# the constant profile flyback of 8 records is far too short
+	config = limited_config('3D')
+	config['galvo']['profile'] = 'constant_acceleration'
+	assert path.exceeded_limits(Path(config, '3D').make_volume_path(),
+			16000., 200., 2e5, 1e9) == ['velocity', 'acceleration', 'jerk']
+
+def test_flyback_length_from_one_move_of_each_kind():
+	for mode, geometry in [('3D', {}), ('3D', {'bidirectional':True}),
+			('crosshair', {})]:
+		for count in (1, 2, 5, 8):
+			scan = Path(limited_config(mode, numTomograms=count,
+					**geometry), mode)
+			closed = mode != '3D'
+			moves = scan.scan_path.moves(closed)
+			assert sum(n for i, k, n in moves) == count
+			assert len(moves) <= 3
+			trajectory, flyback = path.join_lines_limited(scan.scan_path,
+					path.galvo_limits(scan.config), 16000., closed)
+			assert scan.flyback_length() == flyback
+
+def test_lines_faster_than_the_galvos_are_refused():
+	scan = Path(limited_config('3D', numRecords=32), '3D')
+	try:
+		scan.make_volume_path()
+	except ValueError:
+		pass
+	else:
+		assert False
+
+def test_line_by_line_steps_respect_the_galvo_limits():
+	for mode in ('3D', 'radial'):
+		scan = Path(limited_config(mode, volume=False), mode)
+		steps = []
+		while scan.has_next():
+			line = scan.next()
+			step = scan.next_return()
+			assert np.allclose(step[0], line[-1])
+			check_limits(step, 10000., 200., 2e5, 1e9)
+			steps.append(len(step))
+		assert np.allclose(step[-1], [0., 0.])
+		line = 256/16000.
+		assert np.allclose(scan.duty_cycle(16000., 10000.),
+				line/(line + np.mean(steps)/10000.))
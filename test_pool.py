@@ -0,0 +1,38 @@
+import numpy as np
+import processor
+import pool
+from test_processor import make_config, raw_frame
+
+def test_pool_returns_images_in_acquisition_order():
+	config = make_config(resample_pts=1024, window='hann', db=True)
+	parameters = {"brightness":-60, "contrast":4}
+	frames = [np.roll(raw_frame(16), i, axis=0) for i in range(10)]
+	processing = pool.ProcessingPool(config, frames[0].shape, np.int32, 3, 4)
+	images = []
+	for frame in frames:
+		processing.put(frame, parameters)
+		images += list(processing.results())
+	images += list(processing.results(block=True))
+	stats = processing.stats()
+	processing.close()
+	assert len(images) == len(frames)
+	for frame, image in zip(frames, images):
+		assert np.array_equal(image, processor.process(frame, parameters, config))
+	assert stats['depth'] == 0
+	assert sum(stats['frames']) == len(frames)
+
+def test_waiting_on_a_dead_worker_raises():
+	config = make_config()
+	frame = raw_frame(16)
+	processing = pool.ProcessingPool(config, frame.shape, np.int32, 1, 2)
+	worker = processing.workers[0]
+	worker.terminate()
+	worker.join()
+	processing.put(frame, {"brightness":-60, "contrast":4})
+	try:
+		list(processing.results(block=True))
+	except RuntimeError:
+		pass
+	else:
+		assert False
+	processing.close()
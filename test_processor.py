@@ -0,0 +1,59 @@
+import numpy as np
+import processor
+from test_resampler import config, fringes
+
+def make_config(**processing):
+	settings = dict(config)
+	settings['processing'] = processing
+	return settings
+
+def raw_frame(lines=64, num_pts=2420):
+	noise = np.random.RandomState(0).normal(0, 20, (lines,num_pts))
+	return np.int32(4000*fringes(num_pts, lines).T + noise)
+
+def test_fused_matches_current_staged_pipeline():
+	data = np.int32(np.random.RandomState(1).normal(0, 2, (64,320)))
+	parameters = {"brightness":-10, "contrast":2}
+	settings = make_config()
+	expected = processor.process_staged(data, parameters, settings)
+	image = processor.process(data, parameters, settings)
+	assert image.shape == (64,160)
+	assert np.abs(np.int16(image) - expected).max() <= 1
+
+def test_fused_matches_staged_pipeline_with_every_stage():
+	data = raw_frame()
+	parameters = {"brightness":-60, "contrast":4}
+	settings = make_config(resample_pts=1024, window='hann', db=True,
+			depth_start=20, depth_stop=400)
+	expected = processor.process_staged(data, parameters, settings)
+	image = processor.process(data, parameters, settings)
+	assert image.shape == (64,380)
+	assert np.abs(np.int16(image) - expected).max() <= 1
+	assert np.std(expected) > 10
+
+def test_fused_reuses_its_buffers():
+	data = raw_frame()
+	parameters = {"brightness":-60, "contrast":4}
+	settings = make_config(resample_pts=1024, window='hann', db=True)
+	first = processor.process(data, parameters, settings)
+	second = processor.process(data[::-1], parameters, settings)
+	assert first is second
+	out = np.zeros(first.shape, dtype=np.uint8)
+	assert processor.process(data, parameters, settings, out) is out
+
+def test_fused_subtracts_background():
+	data = raw_frame()
+	spectrum = np.random.RandomState(2).normal(1000, 100, data.shape[1])
+	parameters = {"brightness":-60, "contrast":4}
+	for settings in [make_config(), make_config(resample_pts=1024, db=True)]:
+		expected = processor.process_staged(data, parameters, settings, spectrum)
+		image = processor.process(data, parameters, settings, background=spectrum)
+		assert np.abs(np.int16(image) - expected).max() <= 1
+
+def test_int16_frames_give_the_same_image():
+	data = raw_frame()
+	parameters = {"brightness":-60, "contrast":4}
+	settings = make_config(resample_pts=1024, window='hann', db=True)
+	expected = processor.process(data, parameters, settings).copy()
+	image = processor.process(np.int16(data), parameters, settings)
+	assert np.array_equal(image, expected)
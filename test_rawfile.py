@@ -0,0 +1,93 @@
+import numpy as np
+import cPickle
+import rawfile
+
+def make_tomograms(count, shape=(64,16)):
+	return [np.asfortranarray(np.random.randint(-2**20, 2**20, shape)).astype(np.int32)
+			for i in range(count)]
+
+def test_frames_are_mapped_by_offset(tmpdir):
+	filename = str(tmpdir.join('data.raw'))
+	tomograms = make_tomograms(3)
+	metadata = {'shape':[64,16], 'dtype':'<i4', 'mode':'3D'}
+	with rawfile.Writer(filename, metadata) as writer:
+		for i, tomogram in enumerate(tomograms[:2]):
+			writer.write(tomogram, float(i))
+	with rawfile.Writer(filename, None, append=True) as writer:
+		writer.write(tomograms[2], 2.0)
+	with open(filename, 'ab') as fd:
+		fd.write('partial frame')
+	metadata, frames = rawfile.load(filename)
+	assert metadata['mode'] == '3D'
+	assert len(frames) == 3
+	assert list(frames['timestamp']) == [0.0, 1.0, 2.0]
+	for i, tomogram in enumerate(tomograms):
+		assert np.array_equal(rawfile.tomogram(frames, i), tomogram)
+	assert rawfile.tomogram(frames, 1).flags.f_contiguous
+
+def test_converts_pickled_raw_data(tmpdir):
+	pickled = str(tmpdir.join('raw_data'))
+	filename = str(tmpdir.join('data.raw'))
+	tomograms = make_tomograms(2)
+	with open(pickled, 'wb') as fd:
+		pickler = cPickle.Pickler(fd, cPickle.HIGHEST_PROTOCOL)
+		for tomogram in tomograms:
+			pickler.dump(tomogram)
+	rawfile.convert(pickled, filename, {'mode':'single'})
+	metadata, frames = rawfile.load(filename)
+	assert metadata['shape'] == [64,16] and metadata['mode'] == 'single'
+	assert np.array_equal(rawfile.tomogram(frames, 1), tomograms[1])
+
+def test_volume_slices_are_views_of_the_file(tmpdir):
+	filename = str(tmpdir.join('data.raw'))
+	tomograms = make_tomograms(4)
+	with rawfile.Writer(filename, {'shape':[64,16], 'dtype':'<i4'}) as writer:
+		for tomogram in tomograms:
+			writer.write(tomogram)
+	volume = rawfile.Volume(filename)
+	expected = np.array(tomograms)
+	assert volume.shape == (4,64,16) and len(volume) == 4
+	assert np.array_equal(volume.tomogram(2), expected[2])
+	assert np.array_equal(volume.record(5), expected[:,:,5])
+	assert np.array_equal(volume.depth(10), expected[:,10,:])
+	assert np.array_equal(volume[1:3,::2], expected[1:3,::2])
+	assert isinstance(volume[1], np.memmap)
+
+def test_async_writer_batches_frames_in_order(tmpdir):
+	filename = str(tmpdir.join('data.raw'))
+	tomograms = make_tomograms(10)
+	metadata = {'shape':[64,16], 'dtype':'<i4', 'mode':'3D'}
+	writer = rawfile.AsyncWriter(filename, metadata, queue=4, batch=3,
+			fsync='batch')
+	for i, tomogram in enumerate(tomograms):
+		writer.put(tomogram, float(i))
+	writer.close()
+	stats = writer.stats()
+	assert stats['frames'] == len(writer) == 10
+	assert 1 <= stats['high_water'] <= 4
+	volume = rawfile.Volume(filename)
+	assert np.array_equal(volume.timestamps, np.arange(10))
+	for i, tomogram in enumerate(tomograms):
+		assert np.array_equal(volume.tomogram(i), tomogram)
+
+def test_resume_keeps_the_indexed_frames(tmpdir):
+	filename = str(tmpdir.join('data.raw'))
+	tomograms = make_tomograms(4)
+	metadata = {'shape':[64,16], 'dtype':'<i4', 'mode':'3D'}
+	writer = rawfile.AsyncWriter(filename, metadata, index=True)
+	for i, tomogram in enumerate(tomograms[:3]):
+		writer.put(tomogram, float(i))
+	writer.close()
+	# a crash while writing the fourth frame
+	with open(filename, 'ab') as fd:
+		fd.write('partial frame')
+	assert list(rawfile.read_index(filename)['tomogram']) == [0, 1, 2]
+	assert rawfile.resume(filename) == 3
+	writer = rawfile.AsyncWriter(filename, None, append=True, index=True)
+	writer.put(tomograms[3], 3.0)
+	writer.close()
+	volume = rawfile.Volume(filename)
+	assert list(volume.index['tomogram']) == [0, 1, 2, 3]
+	assert np.array_equal(volume.timestamps, np.arange(4))
+	for i, tomogram in enumerate(tomograms):
+		assert np.array_equal(volume.tomogram(i), tomogram)
@@ -0,0 +1,64 @@
+import numpy as np
+from scipy import interpolate
+import resampler
+
+config = {"resample_poly_coef":{
+			"p0":7.828889186e-22,
+			"p1":-3.18736270278e-18,
+			"p2":3.14667139887e-15,
+			"p3":-3.48621964457e-11,
+			"p4":-1.66081523288e-08,
+			"p5":0.000527445637389,
+			"p6":0.31539616584,
+			"p7":-2.90074843319}}
+
+def fringes(num_pts, num_records):
+	periods = np.linspace(8, 40, num_records)
+	x = np.arange(num_pts)[:,np.newaxis]
+	return np.cos(2*np.pi*x/periods)*np.exp(-((x - num_pts/2.)/(num_pts/3.))**2)
+
+def spline_resample(raw_data, old_x, new_x):
+	rsp_data = np.zeros((len(new_x),raw_data.shape[-1]))
+	for line in range(raw_data.shape[-1]):
+		tck = interpolate.splrep(old_x,raw_data[:,line])
+		rsp_data[:,line] = interpolate.splev(new_x,tck)
+	return rsp_data
+
+def test_matches_spline_within_tolerance():
+	raw_data = fringes(2420, 16)
+	for kind in ['linear', 'cubic']:
+		resample = resampler.make_resampler(config, 2420, 1024, kind)
+		old_x, new_x = resample.old_x, resample.new_x
+		inside = new_x < old_x[-1]
+		expected = spline_resample(raw_data, old_x, new_x)[inside]
+		error = np.max(np.abs(resample(raw_data)[inside] - expected))
+		assert error < resampler.TOLERANCE[kind], "%s error is %s"%(kind, error)
+
+def test_stack_and_single_line_agree_with_b_scan():
+	raw_data = fringes(2420, 8)
+	resample = resampler.make_resampler(config, 2420, 1024)
+	b_scan = resample(raw_data)
+	assert b_scan.shape == (1024, 8)
+	stack = resample(np.array([raw_data, 2*raw_data]), axis=1)
+	assert np.allclose(stack[1], 2*b_scan)
+	assert np.allclose(resample(raw_data[:,3]), b_scan[:,3])
+
+def test_writes_into_given_buffer():
+	raw_data = np.int32(1000*fringes(2420, 4))
+	resample = resampler.make_resampler(config, 2420, 1024)
+	rsp_data = np.zeros((4,1024))
+	result = resample(raw_data.T, rsp_data, axis=1)
+	assert result is rsp_data
+	assert np.allclose(rsp_data, resample(raw_data).T)
+
+def test_plans_are_cached_until_invalidated():
+	resampler.invalidate()
+	plan = resampler.make_resampler(config, 2420, 1024)
+	assert resampler.make_resampler(config, 2420, 1024) is plan
+	assert resampler.make_resampler(config, 2420, 512) is not plan
+	for num_out in range(resampler.PLAN_CACHE_SIZE + 4):
+		resampler.make_resampler(config, 2420, 100 + num_out)
+	assert len(resampler.plans) == resampler.PLAN_CACHE_SIZE
+	plan = resampler.make_resampler(config, 2420, 1024)
+	resampler.invalidate()
+	assert resampler.make_resampler(config, 2420, 1024) is not plan
@@ -0,0 +1,38 @@
+import numpy as np
+import ring
+
+def test_reader_sees_frames_in_order_and_counts_overruns(tmpdir):
+	filename = str(tmpdir.join('ring'))
+	writer = ring.Ring(filename, 4, (16,8), np.int32)
+	reader = ring.Ring(filename)
+	assert reader.read() is None
+	frames = [np.asfortranarray(np.arange(128, dtype=np.int32).reshape(16,8) + i)
+			for i in range(7)]
+	writer.write(frames[0])
+	sequence, timestamp, frame = reader.read()
+	assert sequence == 0 and np.array_equal(frame, frames[0])
+	assert frame.flags.f_contiguous
+	for f in frames[1:]:
+		writer.write(f)
+	sequence, timestamp, frame = reader.read()
+	assert sequence == 3 and np.array_equal(frame, frames[3])
+	assert reader.dropped == 2
+	sequence, timestamp, frame = reader.read(latest=True)
+	assert sequence == 6 and reader.dropped == 4
+	assert not reader.replaced()
+	ring.Ring(filename, 2, (16,8), np.int32)
+	assert reader.replaced()
+
+def test_background_is_shared(tmpdir):
+	filename = str(tmpdir.join('ring'))
+	writer = ring.Ring(filename, 2, (16,8), np.int32)
+	reader = ring.Ring(filename)
+	writer.background[:] = np.arange(16)
+	assert np.array_equal(reader.background, np.arange(16))
+
+def test_shared_counters_are_aligned(tmpdir):
+	assert ring.HEADER.fields['written'][1]%8 == 0
+	assert ring.HEADER.itemsize%8 == 0
+	frames = ring.Ring(str(tmpdir.join('ring')), 2, (16,8), np.int16)
+	assert frames.header.ctypes.data%8 == 0
+	assert frames.slots.ctypes.data%8 == 0
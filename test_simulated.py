@@ -0,0 +1,240 @@
+import numpy as np
+import threading
+from time import time, sleep
+from configobj import ConfigObj
+from validate import Validator
+import acquirer
+import rawfile
+import ring
+import simulated
+
+def make_config(tmpdir, mode, **geometry):
+	config = ConfigObj('config.ini', configspec='configspec.ini')
+	config.validate(Validator({'log':acquirer.log_type,'float':float}))
+	config['backend'] = 'simulated'
+	config['filename'] = str(tmpdir.join('data.raw'))
+	config['ring_file'] = str(tmpdir.join('ring'))
+	config['background']['file'] = str(tmpdir.join('background.npy'))
+	config['waveforms']['directory'] = str(tmpdir.join('waveforms'))
+	config[mode].update(geometry)
+	return config
+
+def test_fetch_fills_the_buffer_at_the_trigger_rate():
+	scope = simulated.Scope('Sim', trigger_rate=10000.0, frames=2)
+	scope.ConfigureHorizontalTiming(numPts=256, numRecords=200)
+	data = np.zeros((256,200), np.int32, order='F')
+	start = time()
+	scope.InitiateAcquisition()
+	scope.Fetch('0', data)
+	assert time() - start >= 0.02
+	assert data.flags.f_contiguous
+	first = data.copy()
+	scope.InitiateAcquisition()
+	scope.Fetch('0', data)
+	assert np.std(first) > 100
+	assert not np.array_equal(first, data)
+
+def test_output_task_plays_positioning_in_real_time():
+	task = simulated.AnalogOutputTask()
+	task.create_voltage_channel('Dev1/ao1')
+	task.create_voltage_channel('Dev1/ao0')
+	task.configure_timing_sample_clock(source='OnboardClock', rate=1000,
+			samples_per_channel=20)
+	start = time()
+	task.write(np.zeros((20,2)))
+	task.wait_until_done()
+	assert time() - start >= 0.02
+
+def test_single_scan_runs_without_hardware(tmpdir):
+	config = make_config(tmpdir, 'single', numRecords=64, numPts=512)
+	tomogram = acquirer.scan_single(config, None)
+	assert tomogram.shape == (512,64)
+	volume = rawfile.Volume(config['filename'])
+	assert len(volume) == 1
+	assert np.array_equal(volume.tomogram(0), tomogram)
+
+def test_3D_scan_stores_every_tomogram_in_order(tmpdir):
+	config = make_config(tmpdir, '3D', numTomograms=4, numRecords=32,
+			numPts=256)
+	acquirer.scan_3D(config, None)
+	volume = rawfile.Volume(config['filename'])
+	assert volume.shape == (4,256,32)
+	assert np.all(np.diff(volume.timestamps) > 0)
+	assert not np.array_equal(volume.tomogram(0), volume.tomogram(1))
+
+def test_continuous_scan_runs_until_stopped(tmpdir):
+	config = make_config(tmpdir, 'continuous', numRecords=32, numPts=256,
+			numTomograms=3)
+	def stop():
+		acquirer.interrupted = True
+	threading.Timer(0.3, stop).start()
+	acquirer.scan_continuous(config, None)
+	assert ring.Ring(config['ring_file']).written() > 3
+	assert not tmpdir.join('data.raw').check()
+
+class SlowWriter:
+	def __init__(self):
+		self.timestamps = []
+
+	def write(self, tomogram, timestamp):
+		sleep(0.02)
+		self.timestamps.append(timestamp)
+
+def consume(tmpdir, policy, count=10):
+	config = make_config(tmpdir, 'continuous', numRecords=8, numPts=16,
+			numTomograms=3)
+	memory = acquirer.allocate_memory('continuous', config)
+	live = ring.Ring(config['ring_file'], 4, (16,8), np.int32)
+	writer = SlowWriter()
+	consumer = acquirer.Consumer(memory, writer, live, policy=policy)
+	for i in range(count):
+		tomogram = consumer.acquire()
+		tomogram[:] = i
+		consumer.put(tomogram, i)
+	consumer.close()
+	assert consumer.stored + consumer.dropped == count
+	assert consumer.stored == len(writer.timestamps) == live.written()
+	return consumer, writer.timestamps
+
+def test_3D_scans_fetch_in_a_few_buffers(tmpdir):
+	config = make_config(tmpdir, '3D', numTomograms=100, numRecords=32,
+			numPts=256)
+	memory = acquirer.allocate_memory('3D', config)
+	assert len(memory.data) == config['fetch_buffers'] == 4
+	tomogram = acquirer.scan_3D(config, None)
+	assert rawfile.Volume(config['filename']).shape == (100,256,32)
+
+def test_block_policy_stores_every_tomogram(tmpdir):
+	consumer, stored = consume(tmpdir, 'block')
+	assert stored == range(10)
+
+def test_drop_oldest_keeps_the_latest_tomograms(tmpdir):
+	consumer, stored = consume(tmpdir, 'drop_oldest')
+	assert consumer.dropped > 0
+	assert stored == sorted(stored) and stored[-1] == 9
+
+def test_drop_newest_keeps_the_first_tomograms(tmpdir):
+	consumer, stored = consume(tmpdir, 'drop_newest')
+	assert consumer.dropped > 0
+	assert stored == range(len(stored)) and 9 not in stored
+
+def test_batched_3D_scan_splits_the_fetched_blocks(tmpdir):
+	config = make_config(tmpdir, '3D', numTomograms=5, numRecords=32,
+			numPts=256, batch=2)
+	tomogram = acquirer.scan_3D(config, None)
+	assert config['scope']['Horizontal']['numRecords'] == 2*(32 + 64)
+	volume = rawfile.Volume(config['filename'])
+	assert volume.shape == (5,256,32)
+	assert np.all(np.diff(volume.timestamps) > 0)
+	assert not np.array_equal(volume.tomogram(0), volume.tomogram(1))
+
+def test_raw_path_keeps_compact_samples(tmpdir):
+	config = make_config(tmpdir, 'single', numRecords=64, numPts=512)
+	tomogram = acquirer.scan_single(config, None)
+	assert tomogram.dtype == np.int16
+	assert ring.Ring(config['ring_file']).dtype == np.int16
+	volume = rawfile.Volume(config['filename'])
+	assert volume.dtype == np.int16
+	assert volume.metadata['scale'] == 10.0/2**14
+	# the simulated interferograms peak at 1.5 volts
+	assert 1.2 < volume.volts(0).max() < 1.8
+	assert np.allclose(volume.volts(0), tomogram*10.0/2**14)
+	assert tmpdir.join('data.raw').size() == rawfile.HEADER_SIZE + 8 + 2*512*64
+
+def test_interrupted_3D_scan_is_resumed(tmpdir):
+	config = make_config(tmpdir, '3D', numTomograms=5, numRecords=32,
+			numPts=256)
+	acquirer.scan_3D(config, None)
+	complete = rawfile.Volume(config['filename']).tomogram(1).copy()
+	# keep two indexed tomograms and half of the third
+	rawfile.resume(config['filename'])
+	size = rawfile.HEADER_SIZE + int(2.5*(8 + 2*256*32))
+	with open(config['filename'], 'r+b') as fd:
+		fd.truncate(size)
+	with open(rawfile.index_filename(config['filename']), 'r+b') as fd:
+		fd.truncate(2*rawfile.INDEX.itemsize)
+	acquirer.resume_3D(config, None)
+	volume = rawfile.Volume(config['filename'])
+	assert volume.shape == (5,256,32)
+	assert list(volume.index['tomogram']) == range(5)
+	assert np.array_equal(volume.tomogram(1), complete)
+	assert np.all(np.diff(volume.timestamps) > 0)
+
+def test_radial_scan_stores_every_diameter(tmpdir):
+	config = make_config(tmpdir, 'radial', numTomograms=3, numRecords=32,
+			numPts=256)
+	acquirer.scan_radial(config, None)
+	volume = rawfile.Volume(config['filename'])
+	assert volume.shape == (3,256,32)
+	assert list(volume.index['tomogram']) == range(3)
+	assert volume.metadata['mode'] == 'radial'
+
+def test_backward_sweeps_are_reversed_and_aligned():
+	tomogram = np.tile(np.arange(8, dtype=np.int16), (3,1))
+	assert np.array_equal(acquirer.align_backward(tomogram.copy(), 0),
+			tomogram[:,::-1])
+	aligned = acquirer.align_backward(tomogram.copy(), 0.5)
+	assert np.array_equal(aligned[0], [7,7,6,5,4,3,2,1])
+	aligned = acquirer.align_backward(tomogram.astype(float), 0.25)
+	assert np.allclose(aligned[0,1:], np.arange(6.5, -0.5, -1))
+
+def test_bidirectional_3D_scan_reverses_odd_tomograms(tmpdir):
+	geometry = dict(numTomograms=4, numRecords=32, numPts=256, flyback=8)
+	config = make_config(tmpdir.mkdir('forward'), '3D', **geometry)
+	acquirer.scan_3D(config, None)
+	forward = rawfile.Volume(config['filename'])
+	config = make_config(tmpdir.mkdir('both'), '3D', bidirectional=True,
+			**geometry)
+	acquirer.scan_3D(config, None)
+	both = rawfile.Volume(config['filename'])
+	assert np.array_equal(both.tomogram(0), forward.tomogram(0))
+	assert np.array_equal(both.tomogram(1), forward.tomogram(1)[:,::-1])
+	assert np.array_equal(both.tomogram(2), forward.tomogram(2))
+
+def test_repeated_volume_scans_reuse_the_waveform(tmpdir):
+	config = make_config(tmpdir, '3D', numTomograms=3, numRecords=32,
+			numPts=256)
+	acquirer.scan_3D(config, None)
+	acquirer.scan_3D(config, None)
+	cache = acquirer.waveforms.get_cache(config['waveforms'])
+	assert cache.misses == 1 and cache.hits == 1
+	assert len(tmpdir.join('waveforms').listdir()) == 1
+
+def test_resuming_a_complete_scan_acquires_nothing(tmpdir):
+	config = make_config(tmpdir, '3D', numTomograms=3, numRecords=32,
+			numPts=256)
+	acquirer.scan_3D(config, None)
+	size = tmpdir.join('data.raw').size()
+	assert acquirer.scan(config, None, '3D', resume=True) is None
+	assert tmpdir.join('data.raw').size() == size
+	assert rawfile.Volume(config['filename']).shape == (3,256,32)
+
+def test_scan_stopped_before_the_first_fetch_returns_nothing(tmpdir):
+	config = make_config(tmpdir, 'continuous', numRecords=32, numPts=256)
+	signal = acquirer.interrupt.signal
+	def interrupt_at_once(number, handler):
+		signal(number, handler)
+		acquirer.interrupted = True
+	acquirer.interrupt.signal = interrupt_at_once
+	try:
+		assert acquirer.scan(config, None, 'continuous') is None
+	finally:
+		acquirer.interrupt.signal = signal
+
+def test_jerk_limited_volume_scan_sizes_the_flyback(tmpdir):
+	config = make_config(tmpdir, '3D', numTomograms=3, numRecords=256,
+			numPts=64, flyback=1)
+	config['galvo']['profile'] = 'jerk_limited'
+	acquirer.scan_3D(config, None)
+	flyback = config['3D']['flyback']
+	assert flyback > 1
+	assert config['scope']['Horizontal']['numRecords'] == 256 + flyback
+	assert rawfile.Volume(config['filename']).shape == (3,64,256)
+
+def test_frames_are_made_before_the_first_fetch(tmpdir):
+	config = make_config(tmpdir, 'single', numRecords=64, numPts=512)
+	config['scope']['dtype'] = 'int32'
+	Scope, AnalogOutputTask = acquirer.hardware(config)
+	scope = Scope('Sim')
+	scope.ConfigureHorizontalTiming(numPts=512, numRecords=64)
+	assert scope.frames.keys() == [((512,64), np.dtype(np.int32).str)]
@@ -0,0 +1,25 @@
+import json
+import timing
+
+def test_percentiles_bound_the_durations():
+	timer = timing.Stages()
+	for duration in [1e-3]*90 + [2e-2]*10:
+		timer.last -= duration
+		timer.lap('fetch')
+		timer.frame()
+	stage = timer.summary()['stages']['fetch']
+	assert stage['count'] == 100
+	assert 1e-3 <= stage['p50'] < 1.3e-3
+	assert 2e-2 <= stage['p95'] < 2.6e-2
+	assert 2e-2 <= stage['max'] < 2.1e-2
+	assert timer.report()[1].startswith('fetch')
+
+def test_dump_appends_json_lines(tmpdir):
+	filename = str(tmpdir.join('stats'))
+	timer = timing.Stages()
+	timer.lap('fetch')
+	timer.dump(filename, stage='acquisition')
+	timer.dump(filename, stage='acquisition')
+	lines = open(filename).readlines()
+	assert len(lines) == 2
+	assert json.loads(lines[0])['stages']['fetch']['count'] == 1
@@ -0,0 +1,44 @@
+import os
+import numpy as np
+import waveforms
+
+class Counter:
+	def __init__(self, size=100):
+		self.calls = 0
+		self.size = size
+
+	def __call__(self):
+		self.calls += 1
+		return np.arange(2.*self.size).reshape(-1,2)
+
+def test_waveforms_are_computed_once(tmpdir):
+	directory = str(tmpdir.join('cache'))
+	compute = Counter()
+	cache = waveforms.Cache(directory)
+	key = waveforms.key('volume', '3D', {'x0':0., 'numRecords':512})
+	first = cache.get(key, compute)
+	assert cache.get(key, compute) is first
+	assert not first.flags.writeable
+	again = waveforms.Cache(directory).get(key, compute)
+	assert compute.calls == 1
+	assert np.array_equal(again, first)
+
+def test_keys_follow_the_config():
+	section = {'x0':0., 'numRecords':512}
+	key = waveforms.key('volume', '3D', section)
+	assert key == waveforms.key('volume', '3D', dict(section))
+	assert key != waveforms.key('volume', '3D', dict(section, x0=0.5))
+	assert key != waveforms.key('volume', 'radial', section)
+
+def test_least_recently_used_waveforms_are_evicted(tmpdir):
+	directory = str(tmpdir.join('cache'))
+	compute = Counter(1000)
+	cache = waveforms.Cache(directory, memory=40000, disk=40000)
+	for name in 'ab':
+		cache.get(name, compute)
+		os.utime(cache.filename(name), (0, ord(name)))
+	cache.get('a', compute)
+	cache.get('c', compute)
+	assert list(cache.entries) == ['a', 'c']
+	assert compute.calls == 3
+	assert sorted(os.listdir(directory)) == ['a.npy', 'c.npy']
@@ -0,0 +1,96 @@
+import json
+import math
+import numpy as np
+from time import time
+
+# Histogram bins are 10 per decade from 1 microsecond to 100 seconds.
+SMALLEST = 1e-6
+PER_DECADE = 10
+BINS = 8*PER_DECADE + 1
+
+def bin_index(duration):
+    if duration <= SMALLEST:
+        return 0
+    index = int(PER_DECADE*math.log10(duration/SMALLEST)) + 1
+    return min(index, BINS - 1)
+
+def bin_edge(index):
+    """Upper edge of a histogram bin."""
+    return SMALLEST*10**(index/float(PER_DECADE))
+
+class Stages:
+    """Durations of the stages of every frame of a loop, kept in log spaced
+    histograms so they cost a couple of time() calls per stage and no
+    memory growth. lap(name) charges the time since the previous lap, or
+    since start, to the stage name; frame() counts the frames the stages
+    were run for.
+    """
+    def __init__(self):
+        self.names = []
+        self.counts = {}
+        self.total = {}
+        self.longest = {}
+        self.frames = 0
+        self.start()
+
+    def start(self):
+        self.began = self.last = time()
+
+    def lap(self, name):
+        now = time()
+        duration = now - self.last
+        self.last = now
+        if name not in self.counts:
+            self.names.append(name)
+            self.counts[name] = np.zeros(BINS, np.int64)
+            self.total[name] = 0.0
+            self.longest[name] = 0.0
+        self.counts[name][bin_index(duration)] += 1
+        self.total[name] += duration
+        if duration > self.longest[name]:
+            self.longest[name] = duration
+
+    def skip(self):
+        """Leaves the time since the previous lap out of every stage."""
+        self.last = time()
+
+    def frame(self, count=1):
+        self.frames += count
+
+    def percentile(self, name, q):
+        """Upper bound of the q percentile of a stage duration."""
+        counts = self.counts[name]
+        rank = np.searchsorted(np.cumsum(counts), q/100.0*counts.sum())
+        return min(bin_edge(rank), self.longest[name])
+
+    def summary(self):
+        elapsed = time() - self.began
+        stages = {}
+        for name in self.names:
+            stages[name] = {
+                'count': int(self.counts[name].sum()),
+                'mean': self.total[name]/self.counts[name].sum(),
+                'p50': self.percentile(name, 50),
+                'p95': self.percentile(name, 95),
+                'max': self.longest[name],
+                }
+        return {'frames': self.frames, 'elapsed': elapsed,
+                'rate': self.frames/elapsed if elapsed else 0.0,
+                'stages': stages}
+
+    def report(self):
+        """Summary as lines of text, durations in milliseconds."""
+        summary = self.summary()
+        lines = ["%d frames in %.2f s, %.1f frames/s"%(summary['frames'],
+            summary['elapsed'], summary['rate'])]
+        for name in self.names:
+            stage = summary['stages'][name]
+            lines.append("%-12s p50 %8.3f  p95 %8.3f  max %8.3f ms"%(name,
+                1e3*stage['p50'], 1e3*stage['p95'], 1e3*stage['max']))
+        return lines
+
+    def dump(self, filename, **extra):
+        """Appends the summary as a line of JSON."""
+        summary = dict(self.summary(), time=time(), **extra)
+        with open(filename, 'a') as fd:
+            fd.write(json.dumps(summary) + '\n')
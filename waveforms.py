@@ -0,0 +1,125 @@
+"""Galvo waveforms kept from one scan to the next.
+
+A waveform is stored under the hash of its name and of the config sections
+it is computed from, in memory and as a .npy file of the cache directory,
+so a scan of an unchanged region finds it ready. Past the size bounds the
+least recently used waveforms are evicted, on disk by modification time,
+which every hit refreshes.
+"""
+import os
+import json
+import hashlib
+import logging
+import collections
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+def key(name, *sections):
+    """Hash of a waveform name and the config values it depends on."""
+    text = json.dumps([name] + list(sections), sort_keys=True)
+    return hashlib.sha1(text).hexdigest()
+
+class Cache:
+    """Waveforms in memory up to memory bytes and in directory up to disk
+    bytes. An empty directory keeps them in memory only. Cached waveforms
+    are shared, so they are returned read only."""
+    def __init__(self, directory='', memory=64*2**20, disk=2**30):
+        self.directory = directory
+        self.memory = memory
+        self.disk = disk
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.loads = 0
+        self.misses = 0
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def filename(self, key):
+        return os.path.join(self.directory, key + '.npy')
+
+    def get(self, key, compute):
+        """Waveform stored under key, computed by compute() when it is
+        neither in memory nor on disk."""
+        if key in self.entries:
+            waveform = self.entries.pop(key)
+            self.entries[key] = waveform
+            self.hits += 1
+            self.touch(key)
+            return waveform
+        waveform = self.load(key)
+        if waveform is None:
+            waveform = np.ascontiguousarray(compute())
+            self.misses += 1
+            self.save(key, waveform)
+        waveform.flags.writeable = False
+        self.entries[key] = waveform
+        self.size += waveform.nbytes
+        while self.size > self.memory and len(self.entries) > 1:
+            oldest, evicted = self.entries.popitem(last=False)
+            self.size -= evicted.nbytes
+        return waveform
+
+    def load(self, key):
+        if not self.directory:
+            return None
+        filename = self.filename(key)
+        try:
+            waveform = np.load(filename)
+        except (IOError, ValueError):
+            return None
+        self.touch(key)
+        self.loads += 1
+        return waveform
+
+    def touch(self, key):
+        if self.directory:
+            try:
+                os.utime(self.filename(key), None)
+            except OSError:
+                pass
+
+    def save(self, key, waveform):
+        if not self.directory or waveform.nbytes > self.disk:
+            return
+        filename = self.filename(key)
+        # written aside then renamed, other processes see whole files only
+        partial = '%s.%d.tmp'%(filename, os.getpid())
+        with open(partial, 'wb') as fd:
+            np.save(fd, waveform)
+        os.rename(partial, filename)
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used files past the disk bound."""
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npy'):
+                filename = os.path.join(self.directory, name)
+                stat = os.stat(filename)
+                files.append((stat.st_mtime, stat.st_size, filename))
+        total = sum(size for mtime, size, filename in files)
+        for mtime, size, filename in sorted(files):
+            if total <= self.disk:
+                break
+            try:
+                os.remove(filename)
+            except OSError, msg:
+                logger.warning("Could not evict %s: %s"%(filename, msg))
+            total -= size
+
+    def stats(self):
+        return {'hits':self.hits, 'loads':self.loads, 'misses':self.misses,
+                'waveforms':len(self.entries), 'size':self.size}
+
+caches = {}
+
+def get_cache(settings):
+    """Cache of the [waveforms] settings, shared by the scans of a
+    process."""
+    directory = settings['directory']
+    if directory not in caches:
+        caches[directory] = Cache(directory, settings['memory']*2**20,
+                settings['disk']*2**20)
+    return caches[directory]